@@ -8,7 +8,11 @@ bl_info = {
     "description": "brfuck tool.",
 }
 
-from .gui import register, unregister
+import importlib.util
+
+# dff decoding worker processes import this package without bpy
+if importlib.util.find_spec("bpy") is not None:
+    from .gui import register, unregister
 
 if "bpy" in locals():
     import importlib
@@ -0,0 +1,267 @@
+import os
+import json
+import hashlib
+import threading
+
+from .dff_cache import default_cache_dir
+from .img import img
+
+TEXTURE_EXTENSIONS = ('.png', '.bmp', '.jpg', '.jpeg', '.tga', '.dds')
+ASSET_EXTENSIONS = frozenset(('.dff', '.txd', '.col', '.ide', '.ipl', '.img') + TEXTURE_EXTENSIONS)
+
+INDEX_VERSION = 2
+
+def default_index_dir():
+    return os.path.join(os.path.dirname(default_cache_dir()), 'index')
+
+class AssetIndex:
+
+    # Case insensitive name -> path table of every asset under root, one
+    # dict per extension. The first file found wins, like find_dff_folder.
+    # Saved to disk together with the listing and mtime of every directory.
+    # A changed mtime means files were added, removed or renamed there, only
+    # those directories are listed again by refresh().
+
+    def __init__(self, root, directory=None):
+        self.root = os.path.abspath(root)
+        self.directory = directory or default_index_dir()
+        self.files = {}
+        self.dirs = {}
+        self.archives = None
+        self.radii = None
+        self._radii_changed = False
+        self._thread = None
+
+    def index_path(self):
+        key = hashlib.blake2b(os.path.normcase(self.root).encode('utf-8'), digest_size=16)
+        return os.path.join(self.directory, key.hexdigest() + '.json')
+
+    def radii_path(self):
+        return os.path.splitext(self.index_path())[0] + '.radii.json'
+
+    def start(self):
+
+        # Builds the index in the background, wait() blocks until it is done
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.load, daemon=True)
+            self._thread.start()
+        return self
+
+    def wait(self):
+        if self._thread is None:
+            self.load()
+        else:
+            self._thread.join()
+        return self
+
+    def load(self):
+        self.read_index()
+        if self.scan():
+            self.write_index()
+
+    def refresh(self):
+
+        # Picks up changes made since the index was built, archives are
+        # opened again if the set of IMG files changed
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        archives = dict(self.names('.img'))
+        if self.scan():
+            self.write_index()
+            if self.names('.img') != archives:
+                for archive in self.archives or ():
+                    archive.close()
+                self.archives = None
+        return self
+
+    def list_dir(self, top):
+
+        # [mtime, subdirectories, asset file names] of one directory
+        mtime = os.stat(top).st_mtime_ns
+        with os.scandir(top) as it:
+            entries = sorted(it, key=lambda e: e.name.lower())
+        subdirs = []
+        names = []
+        for e in entries:
+            if e.is_dir(follow_symlinks=False):
+                subdirs.append(e.path)
+            elif os.path.splitext(e.name)[1].lower() in ASSET_EXTENSIONS:
+                names.append(e.name)
+        return [mtime, subdirs, names]
+
+    def scan(self):
+
+        # Walks the tree reusing the stored listing of every directory whose
+        # mtime is unchanged, returns True if anything was listed again
+        previous = self.dirs
+        files = {}
+        dirs = {}
+        changed = False
+        stack = [self.root]
+        while stack:
+            top = stack.pop()
+            listing = previous.get(top)
+            try:
+                if listing is None or os.stat(top).st_mtime_ns != listing[0]:
+                    listing = self.list_dir(top)
+                    changed = True
+            except OSError:
+                changed = changed or top in previous
+                continue
+            dirs[top] = listing
+
+            for filename in listing[2]:
+                name, ext = os.path.splitext(filename.lower())
+                files.setdefault(ext, {}).setdefault(name, os.path.join(top, filename))
+
+            # Same order as os.walk
+            stack.extend(reversed(listing[1]))
+
+        changed = changed or len(dirs) != len(previous)
+        self.files = files
+        self.dirs = dirs
+        return changed
+
+    def read_index(self):
+        try:
+            with open(self.index_path(), 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            if data.get('version') != INDEX_VERSION or data.get('root') != self.root:
+                return False
+            self.dirs = data['dirs']
+        except (OSError, ValueError, KeyError, AttributeError):
+            return False
+        return True
+
+    def write_index(self):
+        data = {
+            'version': INDEX_VERSION,
+            'root': self.root,
+            'dirs': self.dirs,
+        }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = self.index_path() + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as file:
+                json.dump(data, file)
+            os.replace(tmp, self.index_path())
+        except OSError:
+            pass
+
+    def find(self, name, ext):
+        return self.files.get(ext, {}).get(name.lower())
+
+    def names(self, ext):
+        return self.files.get(ext, {})
+
+    def open_archives(self):
+
+        # Every IMG archive under root, opened on first use
+        if self.archives is None:
+            self.archives = []
+            for path in self.names('.img').values():
+                try:
+                    self.archives.append(img().open(path))
+                except (OSError, ValueError):
+                    pass
+        return self.archives
+
+    def entry(self, name, ext):
+
+        # Loose file path, or a view into the first archive holding the
+        # file. Loose files take priority, like the game's modloaders.
+        path = self.find(name, ext)
+        if path:
+            return path
+        filename = name.lower() + ext
+        for archive in self.open_archives():
+            data = archive.read(filename)
+            if data is not None:
+                return data
+        return None
+
+    def entries(self, ext):
+
+        # name -> path or archive view of every file with this extension
+        result = {}
+        for archive in reversed(self.open_archives()):
+            for filename in archive.names(ext):
+                result[filename[:-len(ext)]] = archive.read(filename)
+        result.update(self.names(ext))
+        return result
+
+    def stamp(self, name, ext):
+
+        # [path, size, mtime] of the file entry() returns, or of the archive
+        # holding it
+        path = self.find(name, ext)
+        if path is None:
+            filename = name.lower() + ext
+            path = next((a.path for a in self.open_archives() if filename in a), None)
+        try:
+            stat = os.stat(path)
+        except (OSError, TypeError):
+            return None
+        return [path, stat.st_size, stat.st_mtime_ns]
+
+    def load_radii(self):
+
+        # Bounding radius of every model seen so far, name -> stamp + [radius]
+        if self.radii is None:
+            try:
+                with open(self.radii_path(), 'r', encoding='utf-8') as file:
+                    self.radii = json.load(file)
+                if not isinstance(self.radii, dict):
+                    self.radii = {}
+            except (OSError, ValueError):
+                self.radii = {}
+        return self.radii
+
+    def radius(self, name):
+
+        # Saved radius of a model, None if unknown or the file changed
+        entry = self.load_radii().get(name.lower())
+        if entry and entry[:3] == self.stamp(name, '.dff'):
+            return entry[3]
+        return None
+
+    def set_radius(self, name, radius):
+        stamp = self.stamp(name, '.dff')
+        if stamp:
+            self.load_radii()[name.lower()] = stamp + [radius]
+            self._radii_changed = True
+
+    def write_radii(self):
+        if not self._radii_changed:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = self.radii_path() + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as file:
+                json.dump(self.radii, file)
+            os.replace(tmp, self.radii_path())
+            self._radii_changed = False
+        except OSError:
+            pass
+
+    def __len__(self):
+        return sum(len(names) for names in self.files.values())
+
+# One index per root for the whole session
+_indexes = {}
+
+def get_index(root, directory=None):
+
+    # Directories changed since the last call are listed again
+    root = os.path.abspath(root)
+    index = _indexes.get(root)
+    if index is None:
+        index = _indexes[root] = AssetIndex(root, directory).start()
+    else:
+        index.refresh()
+    return index
+
+def forget_index(root):
+    index = _indexes.pop(os.path.abspath(root), None)
+    for archive in (index and index.archives) or ():
+        archive.close()
@@ -0,0 +1,243 @@
+from array import array
+from collections import namedtuple
+from struct import unpack_from
+
+import numpy as np
+
+from .dff import ElementArray, Sections, Vector, Sphere
+
+ColBounds = namedtuple("ColBounds", "min max center radius")
+ColBox    = namedtuple("ColBox"   , "min_x min_y min_z max_x max_y max_z")
+ColFace   = namedtuple("ColFace"  , "a b c")
+
+# On disk records, only used to read whole blocks with Sections.read_array.
+# surface packs the material, flag, brightness and light bytes (COL2+ faces
+# only material and light).
+Col1Sphere = namedtuple("Col1Sphere", "radius x y z surface")
+Col2Sphere = namedtuple("Col2Sphere", "x y z radius surface")
+ColBoxRaw  = namedtuple("ColBoxRaw" , "min_x min_y min_z max_x max_y max_z surface")
+ColFaceRaw = namedtuple("ColFaceRaw", "a b c surface")
+
+VERSIONS = {
+    b'COLL': 1,
+    b'COL2': 2,
+    b'COL3': 3,
+    b'COL4': 4,
+}
+
+# COL2+ flags
+FLAG_NOT_EMPTY   = 0x02
+FLAG_FACE_GROUPS = 0x08
+FLAG_SHADOW_MESH = 0x10
+
+#######################################################
+def _read_raw(record, typecode, data, offset, count):
+    return Sections.read_array(record, data, offset, count, typecode).values
+
+#######################################################
+def _fields(raw, stride, fields):
+
+    # Picks `fields` out of interleaved records of `stride` items each
+    count = len(raw) // stride
+    values = array(raw.typecode, bytes(raw.itemsize * len(fields) * count))
+    for i, field in enumerate(fields):
+        values[i::len(fields)] = raw[field::stride]
+    return values
+
+#######################################################
+def _surfaces(data, offset, stride, count, pos):
+
+    # Material id byte of each record
+    return array('B', bytes(data[offset + pos:offset + stride * count:stride]))
+
+#######################################################
+class CollisionModel:
+
+    __slots__ = [
+        'version',
+        'name',
+        'model_id',
+        'flags',
+        'bounds',
+        'spheres',
+        'sphere_materials',
+        'boxes',
+        'box_materials',
+        'vertices',
+        'faces',
+        'face_materials',
+        'shadow_vertices',
+        'shadow_faces',
+        'shadow_face_materials'
+    ]
+
+    #######################################################
+    def __init__(self):
+
+        self.version               = 0
+        self.name                  = ""
+        self.model_id              = 0
+        self.flags                 = 0
+        self.bounds                = None
+        self.spheres               = ElementArray(Sphere, array('f'))
+        self.sphere_materials      = array('B')
+        self.boxes                 = ElementArray(ColBox, array('f'))
+        self.box_materials         = array('B')
+        self.vertices              = ElementArray(Vector, array('f'))
+        self.faces                 = ElementArray(ColFace, array('I'))
+        self.face_materials        = array('B')
+        self.shadow_vertices       = ElementArray(Vector, array('f'))
+        self.shadow_faces          = ElementArray(ColFace, array('I'))
+        self.shadow_face_materials = array('B')
+
+    #######################################################
+    def from_mem(data, offset=0, bounds_only=False):
+
+        # data holds the model starting with its fourcc
+        self = CollisionModel()
+
+        fourcc, _, name, self.model_id = unpack_from("<4sI22sH", data, offset)
+        self.version = VERSIONS[bytes(fourcc)]
+        self.name = bytes(name).split(b'\0', 1)[0].decode('ascii', 'replace')
+
+        if self.version == 1:
+            radius, *center = unpack_from("<4f", data, offset + 32)
+            box_min = Vector._make(unpack_from("<3f", data, offset + 48))
+            box_max = Vector._make(unpack_from("<3f", data, offset + 60))
+        else:
+            box_min = Vector._make(unpack_from("<3f", data, offset + 32))
+            box_max = Vector._make(unpack_from("<3f", data, offset + 44))
+            *center, radius = unpack_from("<4f", data, offset + 56)
+        self.bounds = ColBounds(box_min, box_max, Vector._make(center), radius)
+
+        if not bounds_only:
+            if self.version == 1:
+                self.read_col1(data, offset + 72)
+            else:
+                self.read_col2(data, offset)
+
+        return self
+
+    #######################################################
+    def read_col1(self, data, pos):
+
+        count = unpack_from("<I", data, pos)[0]
+        raw = _read_raw(Col1Sphere, 'f', data, pos + 4, count)
+        self.spheres = ElementArray(Sphere, _fields(raw, 5, (1, 2, 3, 0)))
+        self.sphere_materials = _surfaces(data, pos + 4, 20, count, 16)
+        pos += 4 + count * 20
+
+        # Unused lines
+        count = unpack_from("<I", data, pos)[0]
+        pos += 4 + count * 24
+
+        count = unpack_from("<I", data, pos)[0]
+        raw = _read_raw(ColBoxRaw, 'f', data, pos + 4, count)
+        self.boxes = ElementArray(ColBox, _fields(raw, 7, range(6)))
+        self.box_materials = _surfaces(data, pos + 4, 28, count, 24)
+        pos += 4 + count * 28
+
+        count = unpack_from("<I", data, pos)[0]
+        self.vertices = Sections.read_array(Vector, data, pos + 4, count)
+        pos += 4 + count * 12
+
+        count = unpack_from("<I", data, pos)[0]
+        raw = _read_raw(ColFaceRaw, 'I', data, pos + 4, count)
+        self.faces = ElementArray(ColFace, _fields(raw, 4, (0, 1, 2)))
+        self.face_materials = _surfaces(data, pos + 4, 16, count, 12)
+
+    #######################################################
+    def read_mesh(self, data, vertices_pos, faces_pos, faces_count):
+
+        # COL2+ meshes, 16 bit fixed point vertices and 8 byte faces. The
+        # vertex count is not stored, it follows from the highest index.
+        raw = _read_raw(ColFaceRaw, 'H', data, faces_pos, faces_count)
+        faces = ElementArray(ColFace, _fields(raw, 4, (0, 1, 2)))
+        materials = _surfaces(data, faces_pos, 8, faces_count, 6)
+
+        count = max(faces.values) + 1 if faces_count else 0
+        fixed = _read_raw(Vector, 'h', data, vertices_pos, count)
+        scaled = np.frombuffer(fixed, dtype=np.int16).astype(np.float32) / 128
+        vertices = ElementArray(Vector, array('f', scaled.tobytes()))
+
+        return vertices, faces, materials
+
+    #######################################################
+    def read_col2(self, data, offset):
+
+        (spheres_count, boxes_count, faces_count, _, self.flags,
+         spheres_pos, boxes_pos, _, vertices_pos, faces_pos, _) = \
+            unpack_from("<HHIB3xI6I", data, offset + 72)
+
+        # Offsets start after the fourcc
+        base = offset + 4
+
+        raw = _read_raw(Col2Sphere, 'f', data, base + spheres_pos, spheres_count)
+        self.spheres = ElementArray(Sphere, _fields(raw, 5, (0, 1, 2, 3)))
+        self.sphere_materials = _surfaces(data, base + spheres_pos, 20, spheres_count, 16)
+
+        raw = _read_raw(ColBoxRaw, 'f', data, base + boxes_pos, boxes_count)
+        self.boxes = ElementArray(ColBox, _fields(raw, 7, range(6)))
+        self.box_materials = _surfaces(data, base + boxes_pos, 28, boxes_count, 24)
+
+        if faces_count:
+            self.vertices, self.faces, self.face_materials = \
+                self.read_mesh(data, base + vertices_pos, base + faces_pos, faces_count)
+
+        if self.version >= 3 and self.flags & FLAG_SHADOW_MESH:
+            shadow_faces_count, shadow_vertices_pos, shadow_faces_pos = \
+                unpack_from("<3I", data, offset + 112)
+            if shadow_faces_count:
+                self.shadow_vertices, self.shadow_faces, self.shadow_face_materials = \
+                    self.read_mesh(data, base + shadow_vertices_pos,
+                                   base + shadow_faces_pos, shadow_faces_count)
+
+#######################################################
+def iter_models(data):
+
+    # (offset, size) of every model in a COL archive or collision chunk
+    pos = 0
+    while pos + 8 <= len(data):
+        fourcc, size = unpack_from("<4sI", data, pos)
+        if bytes(fourcc) not in VERSIONS:
+            break
+        yield pos, size + 8
+        pos += size + 8
+
+#######################################################
+class col:
+
+    #######################################################
+    def __init__(self):
+        self.models = []
+        self.data = b''
+
+    #######################################################
+    def load_memory(self, data, bounds_only=False):
+
+        # With bounds_only nothing past the header and bounding box is read
+        self.data = memoryview(data)
+        self.models = []
+        for pos, size in iter_models(self.data):
+            self.models.append(CollisionModel.from_mem(self.data[:pos + size], pos, bounds_only))
+
+    #######################################################
+    def load_file(self, filename, bounds_only=False):
+        with open(filename, mode='rb') as file:
+            self.load_memory(file.read(), bounds_only)
+
+    #######################################################
+    def find(self, name):
+        name = name.lower()
+        return next((m for m in self.models if m.name.lower() == name), None)
+
+#######################################################
+def read_dff_collisions(loader, bounds_only=False):
+
+    # Decodes the raw Collision Model chunks kept by dff.read_clump
+    models = []
+    for data in loader.collisions:
+        reader = col()
+        reader.load_memory(data, bounds_only)
+        models.extend(reader.models)
+    return models
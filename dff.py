@@ -1,6 +1,9 @@
+from array import array
 from collections import namedtuple
-from struct import unpack_from, calcsize, pack
-from enum import Enum, IntEnum
+from struct import unpack_from, calcsize, pack, pack_into
+from contextlib import contextmanager
+from enum import Enum, IntEnum, IntFlag
+from sys import byteorder
 
 from .pyffi.utils import tristrip
 
@@ -29,6 +32,11 @@ TexDict = namedtuple("TexDict", "texture_count device_id")
 PITexDict = namedtuple("PITexDict", "texture_count device_id")
 
 UserDataSection = namedtuple("UserDataSection", "name data")
+MeshSplit = namedtuple("MeshSplit", "material indices")
+
+# Header only scan results
+DFFHeader      = namedtuple("DFFHeader"      , "rw_version frames_count atomics_count geometries")
+GeometryHeader = namedtuple("GeometryHeader" , "flags triangles_count vertices_count materials_count bounding_sphere")
 
 # geometry flags
 rpGEOMETRYTRISTRIP              = 0x00000001
@@ -64,6 +72,26 @@ class UserDataType(IntEnum):
     USERDATAFLOAT = 2
     USERDATASTRING = 3
 
+# Sections decoded by dff.load_memory, everything else is skipped by size
+class DFFSection(IntFlag):
+    FRAMES      = 0x001
+    GEOMETRY    = 0x002
+    MATERIALS   = 0x004
+    MESH_SPLIT  = 0x008
+    SKIN        = 0x010
+    DELTA_MORPH = 0x020
+    EFFECTS_2D  = 0x040
+    USER_DATA   = 0x080
+    UV_ANIM     = 0x100
+    COLLISION   = 0x200
+    ATOMICS     = 0x400
+
+    # Sections stored inside the geometry list
+    GEOMETRY_LIST = GEOMETRY | MATERIALS | MESH_SPLIT | SKIN | DELTA_MORPH | \
+                    EFFECTS_2D | USER_DATA
+
+    ALL = 0x7FF
+
 # Native Platform Type
 class NativePlatformType(IntEnum):
     D3D7        = 0x1
@@ -158,6 +186,15 @@ class Sections:
         PITexDict: "<2H"
     }
 
+    # array typecodes for types that can be read as a flat block of scalars
+    array_formats = {
+        Vector        : 'f',
+        RGBA          : 'B',
+        Sphere        : 'f',
+        Triangle      : 'H',
+        TexCoords     : 'f',
+    }
+
     library_id = 0 # used for writing
     
     #######################################################
@@ -187,6 +224,46 @@ class Sections:
         else:
             raise NotImplementedError("unknown type", type)
 
+    #######################################################
+    def read_array(type, data, offset, count, typecode=None):
+
+        # Reads `count` consecutive elements with a single copy into a typed
+        # array instead of unpacking (and allocating) them one by one
+        if typecode is None:
+            typecode = Sections.array_formats[type]
+
+        values = array(typecode)
+        size = count * len(type._fields) * values.itemsize
+        values.frombytes(data[offset:offset+size])
+
+        # RenderWare data is always little endian
+        if byteorder == 'big':
+            values.byteswap()
+
+        return ElementArray(type, values)
+
+    #######################################################
+    def write_array(type, items, typecode=None):
+
+        # Packs a whole block of elements at once, from either an
+        # ElementArray or a list of namedtuples
+        if typecode is None:
+            typecode = Sections.array_formats[type]
+
+        if isinstance(items, ElementArray):
+            values = items.values
+            if values.typecode != typecode:
+                values = array(typecode, values)
+        else:
+            values = array(typecode, [v for item in items for v in item])
+
+        # RenderWare data is always little endian
+        if byteorder == 'big':
+            values = array(typecode, values)
+            values.byteswap()
+
+        return values.tobytes()
+
     #######################################################
     def pad_string(str):
 
@@ -250,6 +327,131 @@ class Sections:
     def set_library_id(version, build):
         Sections.library_id = Sections.get_library_id(version,build)
         
+#######################################################
+class ChunkWriter(bytearray):
+
+    # Growable output buffer shared by the whole write path. Chunks are
+    # written with a zero size and back-patched once their content is known,
+    # so nothing gets copied to prepend a header.
+
+    #######################################################
+    @staticmethod
+    def of(out):
+        return ChunkWriter() if out is None else out
+
+    #######################################################
+    def write(self, data):
+        self += data
+
+    #######################################################
+    def pack(self, fmt, *values):
+        self += pack(fmt, *values)
+
+    #######################################################
+    def begin_chunk(self, type):
+        start = len(self)
+        self += pack("<III", type, 0, Sections.library_id)
+        return start
+
+    #######################################################
+    def end_chunk(self, start):
+        pack_into("<I", self, start + 4, len(self) - start - 12)
+
+    #######################################################
+    @contextmanager
+    def chunk(self, type):
+        start = self.begin_chunk(type)
+        yield self
+        self.end_chunk(start)
+
+    #######################################################
+    def write_chunk(self, data, type):
+        self += pack("<III", type, len(data), Sections.library_id)
+        self += data
+
+#######################################################
+class ElementArray:
+
+    # A block of namedtuples (vertices, uvs, triangles...) stored as a flat
+    # typed array. Elements are built on the fly when indexed or iterated,
+    # so a vertex costs 12 bytes instead of a namedtuple and 3 floats.
+    # Bulk users can work on `values` directly.
+
+    __slots__ = [
+        'type',
+        'values'
+    ]
+
+    #######################################################
+    def __init__(self, type, values=None):
+        self.type   = type
+        self.values = values if values is not None else \
+            array(Sections.array_formats[type])
+
+    #######################################################
+    @staticmethod
+    def from_list(type, items, typecode=None):
+        if typecode is None:
+            typecode = Sections.array_formats[type]
+
+        return ElementArray(
+            type, array(typecode, [v for item in items for v in item])
+        )
+
+    #######################################################
+    @property
+    def width(self):
+        return len(self.type._fields)
+
+    #######################################################
+    def __len__(self):
+        return len(self.values) // self.width
+
+    #######################################################
+    def __getitem__(self, index):
+        w = self.width
+
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if index < 0 or index * w >= len(self.values):
+            raise IndexError("ElementArray index out of range")
+
+        return self.type._make(self.values[index * w:index * w + w])
+
+    #######################################################
+    def __setitem__(self, index, value):
+        w = self.width
+
+        if index < 0:
+            index += len(self)
+        self.values[index * w:index * w + w] = array(self.values.typecode, value)
+
+    #######################################################
+    def __iter__(self):
+        it = iter(self.values)
+        return map(self.type._make, zip(*[it] * self.width))
+
+    #######################################################
+    def __eq__(self, other):
+        if isinstance(other, ElementArray):
+            return self.type is other.type and self.values == other.values
+        return list(self) == list(other)
+
+    #######################################################
+    def __repr__(self):
+        return "ElementArray(%s, %d)" % (self.type.__name__, len(self))
+
+    #######################################################
+    def append(self, item):
+        self.values.extend(item)
+
+    #######################################################
+    def extend(self, items):
+        self.values.extend(v for item in items for v in item)
+
 #######################################################
 class Texture:
 
@@ -280,19 +482,18 @@ class Texture:
         return self
 
     #######################################################
-    def to_mem(self):
+    def to_mem(self, out=None):
 
-        data = b''
-        data += pack("<2B2x", self.filters, self.uv_addressing)
+        out = ChunkWriter.of(out)
+        with out.chunk(types["Texture"]):
 
-        data  = Sections.write_chunk(data, types["Struct"])
-        data += Sections.write_chunk(Sections.pad_string(self.name),
-                                     types["String"])
-        data += Sections.write_chunk(Sections.pad_string(self.mask),
-                                     types["String"])
-        data += Sections.write_chunk(b'', types["Extension"])
+            out.write_chunk(pack("<2B2x", self.filters, self.uv_addressing),
+                            types["Struct"])
+            out.write_chunk(Sections.pad_string(self.name), types["String"])
+            out.write_chunk(Sections.pad_string(self.mask), types["String"])
+            out.write_chunk(b'', types["Extension"])
 
-        return Sections.write_chunk(data, types["Texture"])
+        return out
 
 #######################################################
 class Material:
@@ -357,43 +558,47 @@ class Material:
             self.plugins[key].append(plugin)
 
     #######################################################
-    def bumpfx_to_mem(self):
+    def bumpfx_to_mem(self, out=None):
 
-        data = b''
+        out = ChunkWriter.of(out)
         bump_map = self.plugins['bump_map'][0]
         
-        data += pack("<IfI", 1, bump_map.intensity, bump_map.bump_map is not None)
+        out.pack("<IfI", 1, bump_map.intensity, bump_map.bump_map is not None)
         if bump_map.bump_map is not None:
-            data += bump_map.bump_map.to_mem()
+            bump_map.bump_map.to_mem(out)
 
-        data += pack("<I", bump_map.height_map is not None)
+        out.pack("<I", bump_map.height_map is not None)
         if bump_map.height_map is not None:
-            data += bump_map.height_map.to_mem()
+            bump_map.height_map.to_mem(out)
 
-        return data
+        return out
 
     #######################################################
-    def envfx_to_mem(self):
+    def envfx_to_mem(self, out=None):
+
+        out = ChunkWriter.of(out)
         env_map = self.plugins['env_map'][0]
         
-        data = pack("<IfII",
-                    2,
-                    env_map.coefficient,
-                    env_map.use_fb_alpha,
-                    env_map.env_map is not None
+        out.pack("<IfII",
+                 2,
+                 env_map.coefficient,
+                 env_map.use_fb_alpha,
+                 env_map.env_map is not None
         )
         if env_map.env_map is not None:
-            data += env_map.env_map.to_mem()
+            env_map.env_map.to_mem(out)
 
-        return data
+        return out
 
     #######################################################
-    def plugins_to_mem(self):
-        data = self.matfx_to_mem()
+    def plugins_to_mem(self, out=None):
+
+        out = ChunkWriter.of(out)
+        self.matfx_to_mem(out)
 
         # Specular Material
         if 'spec' in self.plugins:
-            data += Sections.write(
+            out += Sections.write(
                 SpecularMat,
                 self.plugins['spec'][0],
                 types["Specular Material"]
@@ -401,7 +606,7 @@ class Material:
 
         # Reflection Material
         if 'refl' in self.plugins:
-            data += Sections.write(
+            out += Sections.write(
                 ReflMat,
                 self.plugins['refl'][0],
                 types["Reflection Material"]
@@ -409,34 +614,39 @@ class Material:
 
         # UV Animation PLG
         if 'uv_anim' in self.plugins:
-            _data = pack("<I", len(self.plugins['uv_anim']))
-            for frame_name in self.plugins['uv_anim']:
-                _data += pack("<32s", frame_name.encode('ascii'))
-
-            _data = Sections.write_chunk(_data, types["Struct"])
-            data += Sections.write_chunk(_data, types["UV Animation PLG"])
+            with out.chunk(types["UV Animation PLG"]):
+                with out.chunk(types["Struct"]):
+                    out.pack("<I", len(self.plugins['uv_anim']))
+                    for frame_name in self.plugins['uv_anim']:
+                        out.pack("<32s", frame_name.encode('ascii'))
 
         if 'udata' in self.plugins:
-            data += self.plugins['udata'][0].to_mem()
+            self.plugins['udata'][0].to_mem(out)
             
-        return data
+        return out
     
     #######################################################
-    def matfx_to_mem(self):
-        data = b''
+    def matfx_to_mem(self, out=None):
+
+        out = ChunkWriter.of(out)
+        start = out.begin_chunk(types["Material Effects PLG"])
+
+        # Effect type is patched in once it is known
+        effect_type_pos = len(out)
+        out.pack("<I", 0)
 
         effectType = 0
         if 'bump_map' in self.plugins:
-            data += self.bumpfx_to_mem()
+            self.bumpfx_to_mem(out)
             effectType = 1
             
             if 'env_map' in self.plugins: #rwMATFXEFFECTBUMPENVMAP
-                data += self.envfx_to_mem()
+                self.envfx_to_mem(out)
                 effectType = 3
                 
             
         elif 'env_map' in self.plugins:
-            data += self.envfx_to_mem()
+            self.envfx_to_mem(out)
             effectType = 2
             
         elif 'dual' in self.plugins:
@@ -447,41 +657,47 @@ class Material:
 
         elif 'uv_anim' in self.plugins:
             effectType = 5
-            data += pack("<I", 5)
+            out.pack("<I", 5)
 
         if effectType == 0:
             self._hasMatFX = False
-            return b''
+            del out[start:]
+            return out
             
         if effectType != 3 or effectType != 6: #Both effects are set
-            data += pack("<I", 0)
+            out.pack("<I", 0)
 
         self._hasMatFX = True
-        data = pack("<I", effectType) + data
-        return Sections.write_chunk(data, types["Material Effects PLG"])
+        pack_into("<I", out, effect_type_pos, effectType)
+        out.end_chunk(start)
+        return out
         
     #######################################################
-    def to_mem(self):
+    def to_mem(self, out=None):
+
+        out = ChunkWriter.of(out)
+        with out.chunk(types["Material"]):
 
-        data = pack("<4x")
-        data += Sections.write(RGBA, self.color)
-        data += pack("<II", 1, len(self.textures) > 0)
+            with out.chunk(types["Struct"]):
+                out.pack("<4x")
+                out += Sections.write(RGBA, self.color)
+                out.pack("<II", 1, len(self.textures) > 0)
 
-        if Sections.get_rw_version() > 0x30400:
-            data += Sections.write(GeomSurfPro, self.surface_properties)
+                if Sections.get_rw_version() > 0x30400:
+                    out += Sections.write(GeomSurfPro, self.surface_properties)
 
-        data = Sections.write_chunk(data, types["Struct"])
+            # Only 1 texture is supported (I think)
+            if len(self.textures) > 0:
+                self.textures[0].to_mem(out)
 
-        # Only 1 texture is supported (I think)
-        if len(self.textures) > 0:
-            data += self.textures[0].to_mem()
+            with out.chunk(types["Extension"]):
+                self.plugins_to_mem(out)
 
-        data += Sections.write_chunk(self.plugins_to_mem(), types["Extension"])
-        return Sections.write_chunk(data, types["Material"])
+        return out
 
     #######################################################
     def __hash__(self):
-        return hash(self.to_mem())
+        return hash(bytes(self.to_mem()))
 
 #######################################################
 class Atomic:
@@ -583,16 +799,18 @@ class UserData:
         return self
 
     #######################################################
-    def to_mem (self):
-        data = b''
+    def to_mem (self, out=None):
+
+        out = ChunkWriter.of(out)
+        start = out.begin_chunk(types["User Data PLG"])
 
-        data += pack("<I", len(self.sections))
+        out.pack("<I", len(self.sections))
         for section in self.sections:
             section:UserDataSection
 
             # Write name
-            data += pack("<I%ds" % (len(section.name)),
-                         len(section.name), section.name.encode("ascii"))
+            out.pack("<I%ds" % (len(section.name)),
+                     len(section.name), section.name.encode("ascii"))
 
             userTypes = {
                 int: UserDataType.USERDATAINT,
@@ -606,16 +824,17 @@ class UserData:
                 data_type = userTypes[type(section.data[0])]
 
             # Write Elements
-            data += pack("<II", data_type, total_elements)
+            out.pack("<II", data_type, total_elements)
             if data_type == UserDataType.USERDATAINT:
-                data += pack("<%dI" % (total_elements), *section.data)
+                out.pack("<%dI" % (total_elements), *section.data)
             elif data_type == UserDataType.USERDATAFLOAT:
-                data += pack("<%df" % (total_elements), *section.data)
+                out.pack("<%df" % (total_elements), *section.data)
             elif data_type == UserDataType.USERDATASTRING:
                 for string in section.data:
-                    data += pack("<I%ds" % len(string), len(string), string.encode("ascii"))
+                    out.pack("<I%ds" % len(string), len(string), string.encode("ascii"))
 
-        return Sections.write_chunk(data, types["User Data PLG"])
+        out.end_chunk(start)
+        return out
 
 #######################################################
 class Frame:
@@ -643,14 +862,14 @@ class Frame:
         self.animation_data  = None
 
     ##################################################################
-    def from_mem(data):
+    def from_mem(data, offset=0):
 
         self = Frame()
         
-        self.rotation_matrix = Sections.read(Matrix,data)
-        self.position        = Sections.read(Vector,data,36)
-        self.parent          = unpack_from("<i", data,48)[0]
-        self.creation_flags  = unpack_from("<I", data,52)[0]
+        self.rotation_matrix = Sections.read(Matrix,data,offset)
+        self.position        = Sections.read(Vector,data,offset+36)
+        self.parent          = unpack_from("<i", data,offset+48)[0]
+        self.creation_flags  = unpack_from("<I", data,offset+52)[0]
 
         return self
 
@@ -664,21 +883,21 @@ class Frame:
         return data
 
     #######################################################
-    def extensions_to_mem(self):
+    def extensions_to_mem(self, out=None):
 
-        data = b''
+        out = ChunkWriter.of(out)
+        with out.chunk(types["Extension"]):
 
-        if self.name is not None and self.name != "unknown":
-            data += Sections.write_chunk(Sections.pad_string(self.name),
-                                         types["Frame"])
+            if self.name is not None and self.name != "unknown":
+                out.write_chunk(Sections.pad_string(self.name), types["Frame"])
 
-        if self.bone_data is not None:
-            data += self.bone_data.to_mem()
+            if self.bone_data is not None:
+                self.bone_data.to_mem(out)
 
-        if self.user_data is not None:
-            data += self.user_data.to_mem()
+            if self.user_data is not None:
+                self.user_data.to_mem(out)
         
-        return Sections.write_chunk(data, types["Extension"])
+        return out
 
     ##################################################################
     def size():
@@ -713,18 +932,19 @@ class HAnimPLG:
 
         return self
     #######################################################
-    def to_mem(self):
+    def to_mem(self, out=None):
 
-        data = b''
+        out = ChunkWriter.of(out)
+        with out.chunk(types["HAnim PLG"]):
 
-        data += Sections.write(HAnimHeader, self.header)
-        if len(self.bones) > 0:
-            data += pack("<II", 0, 36)
+            out += Sections.write(HAnimHeader, self.header)
+            if len(self.bones) > 0:
+                out.pack("<II", 0, 36)
             
-        for bone in self.bones:
-            data += Sections.write(Bone, bone)
+            for bone in self.bones:
+                out += Sections.write(Bone, bone)
 
-        return Sections.write_chunk(data, types["HAnim PLG"])
+        return out
 
 #######################################################
 # TODO: AnimationPLG data
@@ -788,21 +1008,24 @@ class UVAnim:
         return self
 
     #######################################################
-    def to_mem(self):
+    def to_mem(self, out=None):
+
+        out = ChunkWriter.of(out)
+        with out.chunk(types["Animation Anim"]):
 
-        data = pack("<iiiif4x32s8f",
-                    0x100,
-                    self.type_id,
-                    len(self.frames),
-                    self.flags,
-                    self.duration,
-                    self.name.encode('ascii'),
-                    *self.node_to_uv)
+            out.pack("<iiiif4x32s8f",
+                     0x100,
+                     self.type_id,
+                     len(self.frames),
+                     self.flags,
+                     self.duration,
+                     self.name.encode('ascii'),
+                     *self.node_to_uv)
 
-        for frame in self.frames:
-            data += Sections.write(UVFrame, frame)
+            for frame in self.frames:
+                out += Sections.write(UVFrame, frame)
 
-        return Sections.write_chunk(data, types["Animation Anim"])
+        return out
     
 #######################################################
 class SkinPLG:
@@ -851,7 +1074,7 @@ class SkinPLG:
         self.bones_used.sort()
 
     ##################################################################
-    def to_mem(self):
+    def to_mem(self, out=None):
 
         oldver = Sections.get_rw_version() < 0x34000
 
@@ -862,36 +1085,39 @@ class SkinPLG:
             self.max_weights_per_vertex = 0
             self.bones_used = []
 
-        data = b''
-        data += pack("<3Bx", self.num_bones, len(self.bones_used),
-                     self.max_weights_per_vertex)
+        out = ChunkWriter.of(out)
+        start = out.begin_chunk(types["Skin PLG"])
+
+        out.pack("<3Bx", self.num_bones, len(self.bones_used),
+                 self.max_weights_per_vertex)
 
         # Used Bones
         if self.bones_used:
-            data += pack(f"<{len(self.bones_used)}B", *self.bones_used)
+            out.pack(f"<{len(self.bones_used)}B", *self.bones_used)
 
         # 4x Indices
         for indices in self.vertex_bone_indices:
-            data += pack("<4B", *indices)
+            out.pack("<4B", *indices)
 
         # 4x Weight
         for weight in self.vertex_bone_weights:
-            data += pack("<4f", *weight)
+            out.pack("<4f", *weight)
 
         # 4x4 Matrix
         for matrix in self.bone_matrices:
             if oldver:
-                data += pack("<I", 0xDEADDEAD) # interesting value :eyes:
+                out.pack("<I", 0xDEADDEAD) # interesting value :eyes:
 
             for i in matrix:
-                data += pack("<4f", *i)
+                out.pack("<4f", *i)
 
         # Skin split, just write (0, 0, 0) for now.
         # TODO: Support skin split?
         if not oldver:
-            data += pack("<12x")
+            out.pack("<12x")
 
-        return Sections.write_chunk(data, types["Skin PLG"])
+        out.end_chunk(start)
+        return out
 
     ##################################################################
     @staticmethod
@@ -959,7 +1185,7 @@ class SkinPLG:
                 self.bones_used.append(unpack_from("<B", data, pos)[0])
 
             pos = 4 + self._num_used_bones
-            vertices_count = len(geometry.vertices)
+            vertices_count = geometry._num_vertices
 
             # Read vertex bone indices
             _data = unpack_from("<%dB" % (vertices_count * 4), data, pos)
@@ -1033,7 +1259,7 @@ class ExtraVertColorExtension:
         magic = unpack_from("<I", data, offset)[0]
         if magic != 0:
             colors = []
-            for i in range(len(geometry.vertices)):
+            for i in range(geometry._num_vertices):
 
                 offset += 4
                 colors.append(
@@ -1045,13 +1271,16 @@ class ExtraVertColorExtension:
             return ExtraVertColorExtension(colors)
                 
     #######################################################
-    def to_mem(self):
+    def to_mem(self, out=None):
         
-        data = pack("<I", 1)
-        for color in self.colors:
-            data += Sections.write(RGBA, color)
+        out = ChunkWriter.of(out)
+        with out.chunk(types["Extra Vert Color"]):
+
+            out.pack("<I", 1)
+            for color in self.colors:
+                out += Sections.write(RGBA, color)
 
-        return Sections.write_chunk(data, types["Extra Vert Color"])
+        return out
 
 #######################################################
 class Light2dfx:
@@ -1226,7 +1455,9 @@ class PedAttractor2dfx:
 
         self.type = unpack_from("<I", data, offset)[0]
         self.rotation_matrix = Sections.read(Matrix, data, offset + 4)
-        self.external_script = data[offset + 40: strlen(data, offset + 40)]
+        self.external_script = bytes(
+            data[offset + 40: offset + 40 + strlen(data, offset + 40)]
+        )
         self.ped_existing_probabiliy = unpack_from("<I", data, offset + 48)[0]
 
         self.external_script = self.external_script.decode('ascii')
@@ -1494,25 +1725,29 @@ class Extension2dfx:
         return self
 
     #######################################################
-    def to_mem(self):
+    def to_mem(self, out=None):
+
+        out = ChunkWriter.of(out)
 
         # Write only if there are entries
         if self.is_empty():
-            return b''
+            return out
 
-        # Entries length
-        data = pack("<I", len(self.entries))
+        with out.chunk(types['2d Effect']):
 
-        # Entries
-        for entry in self.entries:
-            data += Sections.write(Vector, entry.loc)
+            # Entries length
+            out.pack("<I", len(self.entries))
 
-            entry_data = entry.to_mem()
+            # Entries
+            for entry in self.entries:
+                out += Sections.write(Vector, entry.loc)
 
-            data += pack("<II", entry.effect_id, len(entry_data))
-            data += entry_data
+                entry_data = entry.to_mem()
 
-        return Sections.write_chunk(data, types['2d Effect'])
+                out.pack("<II", entry.effect_id, len(entry_data))
+                out += entry_data
+
+        return out
 
     #######################################################
     def __add__(self, other):
@@ -1562,7 +1797,7 @@ class DeltaMorph:
             if s > 0:
                 data += pack("<B", s)
 
-        data = b''
+        data = bytearray()
         n, li = 0, -1
         for i in self.indices:
             if i != li + 1:
@@ -1577,12 +1812,12 @@ class DeltaMorph:
         return data
 
     #######################################################
-    def from_mem(data):
+    def from_mem(data, offset=0):
         self = DeltaMorph()
 
-        str_len = unpack_from("<I", data)[0]
-        self.name = unpack_from("<%ds" % (str_len), data, 4)[0].decode('ascii')
-        pos = 4 + str_len
+        str_len = unpack_from("<I", data, offset)[0]
+        self.name = unpack_from("<%ds" % (str_len), data, offset + 4)[0].decode('ascii')
+        pos = offset + 4 + str_len
 
         flags, lock_flags, rle_size, verts_num = unpack_from("<IIII", data, pos)
         pos += 16
@@ -1609,15 +1844,17 @@ class DeltaMorph:
         self.bounding_sphere = Sections.read(Sphere, data, pos)
         pos += 16
 
-        self.size = pos
+        self.size = pos - offset
         return self
 
     #######################################################
-    def to_mem(self):
+    def to_mem(self, out=None):
+
+        out = ChunkWriter.of(out)
 
         str_len = len(self.name) + 1
-        data = pack("<I", str_len)
-        data += pack("%ds" % str_len, self.name.encode('ascii'))
+        out.pack("<I", str_len)
+        out.pack("%ds" % str_len, self.name.encode('ascii'))
 
         flags = 0
         if self.positions:
@@ -1635,23 +1872,23 @@ class DeltaMorph:
         # TODO: testing
         lock_flags = flags # self.lock_flags
 
-        data += pack("<IIII", flags, lock_flags, len(indices_rle), verts_num)
-        data += indices_rle
+        out.pack("<IIII", flags, lock_flags, len(indices_rle), verts_num)
+        out += indices_rle
 
         for p in self.positions:
-            data += Sections.write(Vector, p)
+            out += Sections.write(Vector, p)
 
         for n in self.normals:
-            data += Sections.write(Vector, n)
+            out += Sections.write(Vector, n)
 
         for p in self.prelits:
-            data += pack("<I", p)
+            out.pack("<I", p)
 
         for uv in self.uvs:
-            data += Sections.write(TexCoords, uv)
+            out += Sections.write(TexCoords, uv)
 
-        data += Sections.write(Sphere, self.bounding_sphere)
-        return data
+        out += Sections.write(Sphere, self.bounding_sphere)
+        return out
 
 #######################################################
 class DeltaMorphPLG:
@@ -1676,23 +1913,26 @@ class DeltaMorphPLG:
 
         pos = 4
         for i in range(entries_count):
-            dm = DeltaMorph.from_mem(data[pos:])
+            dm = DeltaMorph.from_mem(data, pos)
             self.append_entry(dm)
             pos += dm.size
 
         return self
 
     #######################################################
-    def to_mem(self):
+    def to_mem(self, out=None):
+
+        out = ChunkWriter.of(out)
 
         if not self.entries:
-            return b''
+            return out
 
-        data = pack("<I", len(self.entries))
-        for entry in self.entries:
-            data += entry.to_mem()
+        with out.chunk(types['Delta Morph PLG']):
+            out.pack("<I", len(self.entries))
+            for entry in self.entries:
+                entry.to_mem(out)
 
-        return Sections.write_chunk(data, types['Delta Morph PLG'])
+        return out
 
     #######################################################
     def __add__(self, other):
@@ -1760,13 +2000,13 @@ class Geometry:
 
     #######################################################
     @staticmethod
-    def from_mem(data, parent_chunk):
+    def from_mem(data, parent_chunk, header_only=False):
 
-        # Note: In the following function, I have used a loop
-        #      to load the texture coordinates or prelit colors,
-        #      although I feel that it might be more efficient to
-        #      convert an array to an array of namedtuples.
-        #      I have not found a way yet to implement such a function.
+        # Note: every per-vertex block is read with a single copy into an
+        #      ElementArray, the namedtuples are only created when something
+        #      accesses the elements one by one.
+        #      With header_only, the blocks are skipped and only the flags,
+        #      counts and bounding sphere are read.
 
         self = Geometry()
         
@@ -1785,13 +2025,11 @@ class Geometry:
 
             # Read prelighting colors
             if self.flags & rpGEOMETRYPRELIT:
-                self.prelit_colors = []
-                
-                for i in range(self._num_vertices):
-                    prelit_color = Sections.read(RGBA, data, pos)
-                    self.prelit_colors.append(prelit_color)
-
-                    pos += 4
+                if not header_only:
+                    self.prelit_colors = Sections.read_array(
+                        RGBA, data, pos, self._num_vertices
+                    )
+                pos += 4 * self._num_vertices
 
             # Read Texture Mapping coordinates
             if self.flags & (rpGEOMETRYTEXTURED | rpGEOMETRYTEXTURED2):
@@ -1802,21 +2040,20 @@ class Geometry:
 
                 self.uv_layers = []
                 for i in range(texCount):
-
-                    self.uv_layers.append([]) #add empty new layer
-                    
-                    for j in range(self._num_vertices):
-                        
-                        tex_coord = Sections.read(TexCoords, data, pos)
-                        self.uv_layers[i].append(tex_coord)
-                        pos += 8
+                    if not header_only:
+                        self.uv_layers.append(
+                            Sections.read_array(
+                                TexCoords, data, pos, self._num_vertices
+                            )
+                        )
+                    pos += 8 * self._num_vertices
 
             # Read Triangles
-            for i in range(self._num_triangles):
-                triangle = Sections.read(Triangle, data, pos)
-                self.triangles.append(triangle)
-                
-                pos += 8
+            if not header_only:
+                self.triangles = Sections.read_array(
+                    Triangle, data, pos, self._num_triangles
+                )
+            pos += 8 * self._num_triangles
 
         # Read  morph targets (This should be only once)
         self.bounding_sphere = Sections.read(Sphere, data, pos)
@@ -1826,44 +2063,66 @@ class Geometry:
         self.has_normals = unpack_from("<I", data, pos + 4)[0]
         pos += 8
 
+        if header_only:
+            return self
+
         # read vertices
         if self.has_vertices:
-            for i in range(self._num_vertices):
-                vertice = Sections.read(Vector, data, pos)
-                self.vertices.append(vertice)
-                pos += 12
+            self.vertices = Sections.read_array(
+                Vector, data, pos, self._num_vertices
+            )
+            pos += 12 * self._num_vertices
             
         # read normals
         if self.has_normals:
-            for i in range(self._num_vertices):
-                normal = Sections.read(Vector, data, pos)
-                self.normals.append(normal)
-                pos += 12
+            self.normals = Sections.read_array(
+                Vector, data, pos, self._num_vertices
+            )
+            pos += 12 * self._num_vertices
 
         return self
 
     #######################################################
-    def material_list_to_mem(self):
+    def compact(self):
+
+        # Move attributes that were filled as lists of namedtuples (native
+        # geometry readers, exporters) into the ElementArray storage
+        if isinstance(self.vertices, list):
+            self.vertices = ElementArray.from_list(Vector, self.vertices)
+        if isinstance(self.normals, list):
+            self.normals = ElementArray.from_list(Vector, self.normals)
+        if isinstance(self.prelit_colors, list):
+            self.prelit_colors = ElementArray.from_list(RGBA, self.prelit_colors)
+        if isinstance(self.triangles, list):
+            self.triangles = ElementArray.from_list(Triangle, self.triangles)
+
+        self.uv_layers = [
+            ElementArray.from_list(TexCoords, uv_layer)
+            if isinstance(uv_layer, list) else uv_layer
+            for uv_layer in self.uv_layers
+        ]
+
+    #######################################################
+    def material_list_to_mem(self, out=None):
         # TODO: Support instance materials
 
-        data = b''
-        
-        data += pack("<I", len(self.materials))
-        for i in range(len(self.materials)):
-            data += pack("<i", -1)
+        out = ChunkWriter.of(out)
+        with out.chunk(types["Material List"]):
 
-        data = Sections.write_chunk(data, types["Struct"])
+            with out.chunk(types["Struct"]):
+                out.pack("<I", len(self.materials))
+                out.pack("<%di" % len(self.materials), *[-1] * len(self.materials))
 
-        for material in self.materials:
-            data += material.to_mem()
-            self._hasMatFX = material._hasMatFX if not self._hasMatFX else True
+            for material in self.materials:
+                material.to_mem(out)
+                self._hasMatFX = material._hasMatFX if not self._hasMatFX else True
 
-        return Sections.write_chunk(data, types["Material List"])
+        return out
 
     #######################################################
-    def write_bin_split(self):
+    def write_bin_split(self, out=None):
 
-        data = b''
+        out = ChunkWriter.of(out)
 
         meshes = {}
         is_tri_strip = self.export_flags["triangle_strip"]
@@ -1888,35 +2147,38 @@ class Geometry:
                 meshes[triangle.material] += [triangle.a, triangle.b, triangle.c]
 
         total_indices = sum(len(triangles) for triangles in meshes.values())
-        data += pack("<III", int(is_tri_strip), len(meshes), total_indices)
 
-        for mesh in sorted(meshes):
-            data += pack("<II", len(meshes[mesh]), mesh)
-            data += pack("<%dI" % (len(meshes[mesh])), *meshes[mesh])
+        with out.chunk(types["Bin Mesh PLG"]):
+            out.pack("<III", int(is_tri_strip), len(meshes), total_indices)
 
-        return Sections.write_chunk(data, types["Bin Mesh PLG"])
+            for mesh in sorted(meshes):
+                out.pack("<II", len(meshes[mesh]), mesh)
+                out.pack("<%dI" % (len(meshes[mesh])), *meshes[mesh])
+
+        return out
     
     #######################################################
-    def extensions_to_mem(self, extra_extensions = []):
+    def extensions_to_mem(self, extra_extensions = [], out=None):
 
-        data = b''
+        out = ChunkWriter.of(out)
+        with out.chunk(types["Extension"]):
 
-        # Write Bin Mesh PLG
-        if self.export_flags['write_mesh_plg'] or self.export_flags['exclude_geo_faces']:
-            data += self.write_bin_split()
+            # Write Bin Mesh PLG
+            if self.export_flags['write_mesh_plg'] or self.export_flags['exclude_geo_faces']:
+                self.write_bin_split(out)
         
-        for extension in self.extensions:
-            if self.extensions[extension] is not None:
-                data += self.extensions[extension].to_mem()
+            for extension in self.extensions:
+                if self.extensions[extension] is not None:
+                    self.extensions[extension].to_mem(out)
 
-        # Write extra extensions
-        for extra_extension in extra_extensions:
-            data += extra_extension.to_mem()
+            # Write extra extensions
+            for extra_extension in extra_extensions:
+                extra_extension.to_mem(out)
             
-        return Sections.write_chunk(data, types["Extension"])
+        return out
         
     #######################################################
-    def to_mem(self, extra_extensions = []):
+    def to_mem(self, extra_extensions = [], out=None):
 
         # Set flags
         flags = rpGEOMETRYPOSITIONS
@@ -1936,53 +2198,53 @@ class Geometry:
 
         flags |= (len(self.uv_layers) & 0xff) << 16
 
-        data = b''
-        data += pack("<IIII",
-                     flags,
-                     len(self.triangles) if not self.export_flags["exclude_geo_faces"] else 0,
-                     len(self.vertices),
-                     1)
+        out = ChunkWriter.of(out)
+        start = out.begin_chunk(types["Geometry"])
+        struct_start = out.begin_chunk(types["Struct"])
+
+        out.pack("<IIII",
+                 flags,
+                 len(self.triangles) if not self.export_flags["exclude_geo_faces"] else 0,
+                 len(self.vertices),
+                 1)
 
         # Only present in older RW
         if Sections.get_rw_version() < 0x34000:
-            data += Sections.write(GeomSurfPro, self.surface_properties)
+            out += Sections.write(GeomSurfPro, self.surface_properties)
 
         # Write pre-lit colors
         if flags & rpGEOMETRYPRELIT:
-            for color in self.prelit_colors:
-                data += Sections.write(RGBA, color)
+            out += Sections.write_array(RGBA, self.prelit_colors)
 
         # Write UV Layers
         for uv_layer in self.uv_layers:
-            for tex_coord in uv_layer:
-                data += Sections.write(TexCoords, tex_coord)
+            out += Sections.write_array(TexCoords, uv_layer)
 
         # Write Triangles
         if not self.export_flags["exclude_geo_faces"]:
-            for triangle in self.triangles:
-                data += Sections.write(Triangle, triangle)
+            out += Sections.write_array(Triangle, self.triangles)
 
         # Bounding sphere and has_vertices, has_normals
-        data += Sections.write(Sphere, self.bounding_sphere)
-        data += pack("<II",
-                     1 if len(self.vertices) > 0 else 0,
-                     1 if flags & rpGEOMETRYNORMALS else 0)
+        out += Sections.write(Sphere, self.bounding_sphere)
+        out.pack("<II",
+                 1 if len(self.vertices) > 0 else 0,
+                 1 if flags & rpGEOMETRYNORMALS else 0)
 
         # Write Vertices
-        for vertex in self.vertices:
-            data += Sections.write(Vector, vertex)
+        out += Sections.write_array(Vector, self.vertices)
 
         # Write Normals
         if flags & rpGEOMETRYNORMALS:
-            for normal in self.normals:
-                data += Sections.write(Vector, normal)
+            out += Sections.write_array(Vector, self.normals)
 
-        data = Sections.write_chunk(data, types["Struct"])
+        out.end_chunk(struct_start)
         
         # Write Material List and extensions
-        data += self.material_list_to_mem()
-        data += self.extensions_to_mem(extra_extensions)
-        return Sections.write_chunk(data, types["Geometry"])
+        self.material_list_to_mem(out)
+        self.extensions_to_mem(extra_extensions, out)
+
+        out.end_chunk(start)
+        return out
 
 #######################################################
 
@@ -1999,16 +2261,29 @@ class dff:
     #######################################################
     def raw(self, size, offset=None):
 
+        # self.data is a memoryview, so this is a view and not a copy
         if offset is None:
             offset = self.pos
         
         return self.data[offset:offset+size]
 
+    #######################################################
+    def raw_string(self, encoding="utf-8", offset=None):
+
+        if offset is None:
+            offset = self.pos
+
+        return str(self.raw(strlen(self.data, offset), offset), encoding)
+
     #######################################################
     def read_chunk(self):
         chunk = Sections.read(Chunk, self.data, self._read(12))
         return chunk
 
+    #######################################################
+    def wants(self, sections):
+        return bool(self.sections & sections)
+
     #######################################################
     def read_frame_list(self, parent_chunk):
 
@@ -2020,7 +2295,7 @@ class dff:
         frames_count = unpack_from("<I", self.data, self._read(4))[0]
 
         for i in range(frames_count):
-            frame = Frame.from_mem(self.data[self.pos:])
+            frame = Frame.from_mem(self.data, self.pos)
             self.frame_list.append(frame)
             self._read(Frame.size())
 
@@ -2042,7 +2317,7 @@ class dff:
                 animation_data = None
 
                 if chunk.type == types["Frame"]:
-                    name = self.raw(strlen(self.data,self.pos)).decode("utf-8")
+                    name = self.raw_string()
                     
                 elif chunk.type == types["HAnim PLG"]:
                     bone_data = HAnimPLG.from_mem(self.raw(chunk.size))
@@ -2051,7 +2326,7 @@ class dff:
                     user_data = UserData.from_mem(self.raw(chunk.size))
 
                 elif chunk.type == types["Animation PLG"]:
-                    animation_data = AnimationPLG.from_mem(self.data[self.pos:])
+                    animation_data = AnimationPLG.from_mem(self.raw(chunk.size))
 
                 self._read(chunk.size)
                 if name is not None:
@@ -2074,11 +2349,9 @@ class dff:
 
     #######################################################
     def read_mesh_plg(self, parent_chunk, geometry):
-        triangles = []
         
         _Header      = namedtuple("_Header","flags mesh_count total_indices")
         _SplitHeader = namedtuple("_SplitHeader","indices_count material")
-        _Triangle    = namedtuple("_Triangle", "a b c")
         
         header = _Header._make(unpack_from("<III", self.data, self._read(12)))
 
@@ -2087,6 +2360,10 @@ class dff:
         opengl = calculated_size >= parent_chunk.size
 
         geometry.split_headers = []
+        split_indices = []
+
+        # Triangles of all splits, in the same layout as Triangle
+        triangles = ElementArray(Triangle, array('I'))
 
         is_tri_strip = header.flags == 1
         for i in range(header.mesh_count):
@@ -2101,71 +2378,45 @@ class dff:
             if geometry.flags & rpGEOMETRYNATIVE != 0:
                 continue
 
-            unpack_format = "<H" if opengl else "<H2x"
-            total_iterations = split_header.indices_count
-            
-            # Read 3 integers instead of 1 incase of triangle lists
-            if not is_tri_strip: 
-                unpack_format = "<" + (unpack_format[1:] * 3)
-                total_iterations //= 3
-
-            previous_vertices = []
-            for j in range(total_iterations):
-
-                # Read Triangle Strip
-                if is_tri_strip:
+            # Read the whole index block at once
+            indices = array('H' if opengl else 'I')
+            size = split_header.indices_count * indices.itemsize
+            indices.frombytes(self.raw(size, self._read(size)))
+            if byteorder == 'big':
+                indices.byteswap()
 
-                    vertex = unpack_from(
-                        unpack_format,
-                        self.data,
-                        self._read(2 if opengl else 4)
-                    )[0]
+            if indices.typecode != 'I':
+                indices = array('I', indices)
 
-                    if len(previous_vertices) < 2:
-                        previous_vertices.append(vertex)
-                        continue
+            # Convert Triangle Strip, every odd triangle has flipped winding
+            if is_tri_strip:
+                a, b, c = indices[:-2], indices[1:-1], indices[2:]
+                a[1::2], b[1::2] = b[1::2], a[1::2]
 
-                    if(j % 2 == 0):
-                        triangle = Triangle(
-                            previous_vertices[1],
-                            previous_vertices[0],
-                            split_header.material,
-                            vertex
-                        )
-                    else:
-                        triangle = Triangle(
-                            previous_vertices[0],
-                            previous_vertices[1],
-                            split_header.material,
-                            vertex
-                        )
-                
-                    previous_vertices[0] = previous_vertices[1]
-                    previous_vertices[1] = vertex
-
-                # Read Triangle List
-                else:
-
-                    _triangle = _Triangle._make(
-                        unpack_from(
-                            unpack_format,
-                            self.data,
-                            self._read(6 if opengl else 12)
-                        )
-                    )
-
-                    triangle = Triangle._make(
-                        (
-                            _triangle.b,
-                            _triangle.a,
-                            split_header.material,
-                            _triangle.c
-                        )
-                    )
-
-                triangles.append(triangle)
+            # Read Triangle List
+            else:
+                count = len(indices) - len(indices) % 3
+                a, b, c = indices[0:count:3], indices[1:count:3], indices[2:count:3]
+
+            triangles_count = len(c)
+
+            # Compact triangle list index buffer of this split
+            split_indices.append(MeshSplit(split_header.material, array('I')))
+            if triangles_count > 0:
+                buffer = array('I', bytes(12 * triangles_count))
+                buffer[0::3], buffer[1::3], buffer[2::3] = a, b, c
+                split_indices[-1].indices.extend(buffer)
+
+            # Interleave into Triangle order (b a material c)
+            buffer = array('I', bytes(16 * triangles_count))
+            buffer[0::4] = b
+            buffer[1::4] = a
+            buffer[2::4] = array('I', [split_header.material]) * triangles_count
+            buffer[3::4] = c
+            triangles.values.extend(buffer)
 
         geometry.extensions['mat_split'] = triangles
+        geometry.extensions['mat_split_indices'] = split_indices
 
     #######################################################
     def read_native_data_plg(self, parent_chunk, geometry):
@@ -2310,25 +2561,19 @@ class dff:
         chunk = self.read_chunk() 
 
         # Read a  texture
-        texture = Texture.from_mem(
-            self.data[self.pos:self.pos+chunk.size]
-        )
+        texture = Texture.from_mem(self.raw(chunk.size))
         
         self._read(chunk.size)
         
         # Texture Name
         chunk = self.read_chunk()
-        texture.name = self.raw(
-            strlen(self.data,self.pos)
-        ).decode("utf-8")
+        texture.name = self.raw_string()
         
         self._read(chunk.size)
         
         # Mask Name
         chunk = self.read_chunk()  
-        texture.mask = self.raw(
-            strlen(self.data,self.pos)
-        ).decode("utf-8")
+        texture.mask = self.raw_string()
         
         self._read(chunk.size)
         return texture
@@ -2364,9 +2609,7 @@ class dff:
 
                     # Read header
                     if chunk.type == types["Struct"]:
-                        material = Material.from_mem(
-                            self.data[self.pos:self.pos+chunk.size]
-                        )
+                        material = Material.from_mem(self.raw(chunk.size))
                         self.pos += chunk.size
 
                     # Read textures and extensions
@@ -2413,7 +2656,7 @@ class dff:
                                     if chunk.type == types["User Data PLG"]:
                                         material.add_plugin (
                                             "udata",
-                                            UserData.from_mem(self.data[self.pos:]))
+                                            UserData.from_mem(self.raw(chunk.size)))
                                         
                                     if chunk.type == types["UV Animation PLG"]:
 
@@ -2426,13 +2669,10 @@ class dff:
                                         # Read n animations
                                         for i in range(anim_count[0]):
                                             material.add_plugin('uv_anim',
-                                                                self.raw(
-                                                                    strlen(
-                                                                        self.data,
-                                                                        self.pos
-                                                                    ),
+                                                                self.raw_string(
+                                                                    'ascii',
                                                                     self._read(32)
-                                                                ).decode('ascii')
+                                                                )
                                             )
                                             
                                     self.pos = __chunk_end
@@ -2469,7 +2709,11 @@ class dff:
         chunk_end = self.pos + parent_chunk.size
 
         chunk = self.read_chunk()
-        geometry = Geometry.from_mem(self.data[self.pos:], parent_chunk)
+        geometry = Geometry.from_mem(
+            self.raw(chunk.size),
+            parent_chunk,
+            not self.wants(DFFSection.GEOMETRY)
+        )
 
         self._read(chunk.size)
 
@@ -2479,57 +2723,67 @@ class dff:
 
             chunk = self.read_chunk()
 
-            if chunk.type == types["Material List"]:
+            if chunk.type == types["Material List"] and \
+               self.wants(DFFSection.MATERIALS):
                 self.read_material_list(chunk)
 
             elif chunk.type == types["Extension"]:
                 pass
 
-            elif chunk.type == types["Delta Morph PLG"]:
-                delta_morph = DeltaMorphPLG.from_mem(self.data[self.pos:])
+            elif chunk.type == types["Delta Morph PLG"] and \
+                 self.wants(DFFSection.DELTA_MORPH):
+                delta_morph = DeltaMorphPLG.from_mem(self.raw(chunk.size))
                 geometry.extensions["delta_morph"] = delta_morph
 
                 self._read(chunk.size)
 
-            elif chunk.type == types["Skin PLG"]:
+            elif chunk.type == types["Skin PLG"] and \
+                 self.wants(DFFSection.SKIN):
 
-                skin = SkinPLG.from_mem(self.data[self.pos:], geometry)
+                skin = SkinPLG.from_mem(self.raw(chunk.size), geometry)
                 geometry.extensions["skin"] = skin
 
                 self._read(chunk.size)
 
-            elif chunk.type == types["Extra Vert Color"]:
+            elif chunk.type == types["Extra Vert Color"] and \
+                 self.wants(DFFSection.GEOMETRY):
 
                 geometry.extensions['extra_vert_color'] = \
                     ExtraVertColorExtension.from_mem (
                         self.data, self._read(chunk.size), geometry
                     )
 
-            elif chunk.type == types["User Data PLG"]:
+            elif chunk.type == types["User Data PLG"] and \
+                 self.wants(DFFSection.USER_DATA):
                 geometry.extensions['user_data'] = \
-                    UserData.from_mem(self.data[self.pos:])
+                    UserData.from_mem(self.raw(chunk.size))
 
                 self._read(chunk.size)
 
             # 2dfx (usually at the last geometry index)
-            elif chunk.type == types["2d Effect"]:
+            elif chunk.type == types["2d Effect"] and \
+                 self.wants(DFFSection.EFFECTS_2D):
                 self.ext_2dfx += Extension2dfx.from_mem(
                     self.data,
                     self._read(chunk.size)
                 )
 
-            elif chunk.type == types["Bin Mesh PLG"]:
+            elif chunk.type == types["Bin Mesh PLG"] and \
+                 self.wants(DFFSection.MESH_SPLIT):
                 self.read_mesh_plg(chunk,geometry)
 
-            elif chunk.type == types["Native Data PLG"]:
+            elif chunk.type == types["Native Data PLG"] and \
+                 self.wants(DFFSection.GEOMETRY):
                 self.read_native_data_plg(chunk,geometry)
 
-            elif chunk.type == types["Bone PLG"]:
+            elif chunk.type == types["Bone PLG"] and \
+                 self.wants(DFFSection.GEOMETRY):
                 self.read_bone_plg(chunk,geometry)
 
             else:
                 self._read(chunk.size)
 
+        geometry.compact()
         self.pos = chunk_end
 
     #######################################################
@@ -2544,9 +2798,7 @@ class dff:
 
             # STRUCT
             if chunk.type == types["Struct"]:
-                atomic = Atomic.from_mem(
-                    self.data[self.pos:self.pos+chunk.size]
-                )
+                atomic = Atomic.from_mem(self.raw(chunk.size))
                 self.pos += chunk.size
 
             elif chunk.type == types["Geometry"]:
@@ -2568,11 +2820,13 @@ class dff:
                         atomic.extensions["pipeline"] = pipeline
 
                     # legacy Skin PLG
-                    elif chunk.type == types["Skin PLG"]:
+                    elif chunk.type == types["Skin PLG"] and \
+                         self.wants(DFFSection.SKIN) and \
+                         atomic.frame < len(self.frame_list):
                         frame = self.frame_list[atomic.frame]
                         geometry = self.geometry_list[atomic.geometry]
 
-                        skin = SkinPLG.from_mem(self.data[self.pos:], geometry, frame)
+                        skin = SkinPLG.from_mem(self.raw(chunk.size), geometry, frame)
                         geometry.extensions["skin"] = skin
 
                         bone_frames = self.frame_list[atomic.frame + 1:]
@@ -2616,21 +2870,24 @@ class dff:
                 chunk = self.read_chunk()
 
                 # FRAMELIST
-                if chunk.type == types["Frame List"]:  
+                if chunk.type == types["Frame List"] and \
+                   self.wants(DFFSection.FRAMES):
                     self.read_frame_list(chunk)
 
                 # GEOMETRYLIST
-                elif chunk.type == types["Geometry List"]:  
+                elif chunk.type == types["Geometry List"] and \
+                     self.wants(DFFSection.GEOMETRY_LIST):
                     self.read_geometry_list(chunk)
 
                 # ATOMIC
-                elif chunk.type == types["Atomic"]:  
+                elif chunk.type == types["Atomic"] and \
+                     self.wants(DFFSection.ATOMICS):
                     self.read_atomic(chunk)
 
-                elif chunk.type == types["Collision Model"]:
-                    self.collisions.append(
-                        self.data[self.pos:self.pos + chunk.size]
-                    )
+                elif chunk.type == types["Collision Model"] and \
+                     self.wants(DFFSection.COLLISION):
+                    # Copy so that the collision doesn't keep the whole file alive
+                    self.collisions.append(bytes(self.raw(chunk.size)))
                     self.pos += chunk.size
                     
                 #Not incrementing the position here to read the next extensions
@@ -2654,16 +2911,18 @@ class dff:
 
             if chunk.type == types["Animation Anim"]:
                 self.uvanim_dict.append(
-                    UVAnim.from_mem(self.data[self.pos:])
+                    UVAnim.from_mem(self.raw(chunk.size))
                 )
 
             self._read(chunk.size)
             
     #######################################################
-    def load_memory(self, data):
+    def load_memory(self, data, sections=DFFSection.ALL):
 
-        self.data = data
-        while self.pos < len(data) - 12:
+        # All readers work on views of this buffer, nothing gets copied
+        self.data = memoryview(data)
+        self.sections = sections
+        while self.pos < len(self.data) - 12:
             chunk = self.read_chunk()
 
             if chunk.type == types["Clump"]:
@@ -2671,7 +2930,10 @@ class dff:
                 self.rw_version = Sections.get_rw_version(chunk.version)
 
             elif chunk.type == types["UV Animation Dictionary"]:
-                self.read_uv_anim_dict()
+                if self.wants(DFFSection.UV_ANIM):
+                    self.read_uv_anim_dict()
+                else:
+                    self._read(chunk.size)
 
             elif chunk.type == types["Atomic"]:
                 self.read_atomic(chunk)
@@ -2689,131 +2951,207 @@ class dff:
         self.pos           = 0
         self.data          = ""
         self.rw_version    = ""
+        self.sections      = DFFSection.ALL
             
     #######################################################
-    def load_file(self, filename):
+    def load_file(self, filename, sections=DFFSection.ALL):
 
         with open(filename, mode='rb') as file:
             content = file.read()
-            self.load_memory(content)
-           
+            self.load_memory(content, sections)
+
     #######################################################
-    def write_frame_list(self):
+    def scan_memory(self, data):
 
-        data = b''
+        # Walks the chunk tree and only decodes headers: counts, flags and
+        # bounding spheres. Nothing is stored in the lists of this object.
+        self.data = memoryview(data)
+        self.pos = 0
+
+        rw_version    = None
+        frames_count  = 0
+        atomics_count = 0
+        geometries    = []
+
+        while self.pos < len(self.data) - 12:
+            chunk = self.read_chunk()
+            chunk_end = self.pos + chunk.size
+
+            # Descend into the containers
+            if chunk.type == types["Clump"]:
+                rw_version = Sections.get_rw_version(chunk.version)
+                continue
+
+            elif chunk.type == types["Geometry List"]:
+                continue
+
+            elif chunk.type == types["Frame List"]:
+                self.read_chunk()
+                frames_count = unpack_from("<I", self.data, self.pos)[0]
+
+            elif chunk.type == types["Atomic"]:
+                atomics_count += 1
+
+            elif chunk.type == types["Geometry"]:
+                struct = self.read_chunk()
+                geometry = Geometry.from_mem(self.raw(struct.size), chunk, True)
+                self._read(struct.size)
+
+                materials_count = 0
+                while self.pos < chunk_end:
+                    sub_chunk = self.read_chunk()
+                    sub_chunk_end = self.pos + sub_chunk.size
+
+                    if sub_chunk.type == types["Material List"]:
+                        self.read_chunk()
+                        materials_count = unpack_from("<I", self.data, self.pos)[0]
+
+                    self.pos = sub_chunk_end
+
+                geometries.append(
+                    GeometryHeader(
+                        geometry.flags,
+                        geometry._num_triangles,
+                        geometry._num_vertices,
+                        materials_count,
+                        geometry.bounding_sphere
+                    )
+                )
+
+            self.pos = chunk_end
+
+        self.data = ""
+        self.pos = 0
+        return DFFHeader(rw_version, frames_count, atomics_count, geometries)
+
+    #######################################################
+    def scan_file(self, filename):
+
+        with open(filename, mode='rb') as file:
+            return self.scan_memory(file.read())
+           
+    #######################################################
+    def write_frame_list(self, out=None):
 
-        data += pack("<I", len(self.frame_list)) # length
+        out = ChunkWriter.of(out)
+        with out.chunk(types["Frame List"]):
 
-        for frame in self.frame_list:
-            data += frame.header_to_mem()
+            with out.chunk(types["Struct"]):
+                out.pack("<I", len(self.frame_list)) # length
 
-        data = Sections.write_chunk(data, types["Struct"])
+                for frame in self.frame_list:
+                    out += frame.header_to_mem()
         
-        for frame in self.frame_list:
-            data += frame.extensions_to_mem()
+            for frame in self.frame_list:
+                frame.extensions_to_mem(out)
 
-        return Sections.write_chunk(data, types["Frame List"])
+        return out
 
     #######################################################
-    def write_geometry_list(self):
-        data = b''
-        data += pack("<I", len(self.geometry_list))
+    def write_geometry_list(self, out=None):
 
-        data = Sections.write_chunk(data, types["Struct"])
+        out = ChunkWriter.of(out)
+        with out.chunk(types["Geometry List"]):
+
+            out.write_chunk(pack("<I", len(self.geometry_list)), types["Struct"])
         
-        for index, geometry in enumerate(self.geometry_list):
+            for index, geometry in enumerate(self.geometry_list):
 
-            # Append 2dfx to extra extensions in the last geometry
-            extra_extensions = []
-            if index == len(self.geometry_list) - 1 and not self.ext_2dfx.is_empty():
-                extra_extensions.append(self.ext_2dfx)
+                # Append 2dfx to extra extensions in the last geometry
+                extra_extensions = []
+                if index == len(self.geometry_list) - 1 and not self.ext_2dfx.is_empty():
+                    extra_extensions.append(self.ext_2dfx)
             
-            data += geometry.to_mem(extra_extensions)
+                geometry.to_mem(extra_extensions, out)
         
-        return Sections.write_chunk(data, types["Geometry List"])
+        return out
 
     #######################################################
-    def write_atomic(self, atomic):
+    def write_atomic(self, atomic, out=None):
 
-        data = atomic.to_mem()
-        data = Sections.write_chunk(data, types["Struct"])
+        out = ChunkWriter.of(out)
         geometry = self.geometry_list[atomic.geometry]
 
-        ext_data = b''
-        if "skin" in geometry.extensions:
-            right_to_render = atomic.extensions.get("right_to_render")
-            if not right_to_render:
-                right_to_render = RightToRender._make((0x0116, 1))
-            ext_data += Sections.write_chunk(
-                pack("<II", right_to_render.value1, right_to_render.value2),
-                types["Right to Render"]
-            )
+        with out.chunk(types["Atomic"]):
+            out.write_chunk(atomic.to_mem(), types["Struct"])
+
+            with out.chunk(types["Extension"]):
+                if "skin" in geometry.extensions:
+                    right_to_render = atomic.extensions.get("right_to_render")
+                    if not right_to_render:
+                        right_to_render = RightToRender._make((0x0116, 1))
+                    out.write_chunk(
+                        pack("<II", right_to_render.value1, right_to_render.value2),
+                        types["Right to Render"]
+                    )
 
-        if geometry._hasMatFX:
-            ext_data += Sections.write_chunk(
-                pack("<I", 1),
-                types["Material Effects PLG"]
-            )
+                if geometry._hasMatFX:
+                    out.write_chunk(
+                        pack("<I", 1),
+                        types["Material Effects PLG"]
+                    )
 
-        pipeline = atomic.extensions.get("pipeline")
-        if pipeline is not None:
-            ext_data += Sections.write_chunk(
-                pack("<I", pipeline),
-                types["Pipeline Set"]
-            )
+                pipeline = atomic.extensions.get("pipeline")
+                if pipeline is not None:
+                    out.write_chunk(
+                        pack("<I", pipeline),
+                        types["Pipeline Set"]
+                    )
 
-        data += Sections.write_chunk(ext_data, types["Extension"])
-        return Sections.write_chunk(data, types["Atomic"])
+        return out
 
     #######################################################
-    def write_uv_dict(self):
+    def write_uv_dict(self, out=None):
+
+        out = ChunkWriter.of(out)
 
         if len(self.uvanim_dict) < 1:
-            return b''
+            return out
         
-        data = pack("<I", len(self.uvanim_dict))
-        data = Sections.write_chunk(data, types["Struct"])
+        with out.chunk(types["UV Animation Dictionary"]):
+            out.write_chunk(pack("<I", len(self.uvanim_dict)), types["Struct"])
         
-        for dictionary in self.uvanim_dict:
-            data += dictionary.to_mem()
+            for dictionary in self.uvanim_dict:
+                dictionary.to_mem(out)
 
-        return Sections.write_chunk(data, types["UV Animation Dictionary"])
+        return out
 
     #######################################################
-    def write_clump(self):
+    def write_clump(self, out=None):
 
-        data = Sections.write(Clump, (len(self.atomic_list), 0,0), types["Struct"])
+        out = ChunkWriter.of(out)
+        with out.chunk(types["Clump"]):
 
-        # Old RW versions didn't have cameras and lights in their clump structure
-        if Sections.get_rw_version() < 0x33000:
-            data = Sections.write_chunk(pack("<I",
-                                             len(self.atomic_list)),
-                                        types["Struct"])
+            # Old RW versions didn't have cameras and lights in their clump structure
+            if Sections.get_rw_version() < 0x33000:
+                out.write_chunk(pack("<I", len(self.atomic_list)), types["Struct"])
+            else:
+                out += Sections.write(Clump, (len(self.atomic_list), 0,0), types["Struct"])
             
-        data += self.write_frame_list()
-        data += self.write_geometry_list()
+            self.write_frame_list(out)
+            self.write_geometry_list(out)
 
-        for atomic in self.atomic_list:
-            data += self.write_atomic(atomic)
+            for atomic in self.atomic_list:
+                self.write_atomic(atomic, out)
 
-        for coll_data in self.collisions:
-            _data = Sections.write_chunk(coll_data, types["Collision Model"])
-            data += Sections.write_chunk(_data, types["Extension"])
+            for coll_data in self.collisions:
+                with out.chunk(types["Extension"]):
+                    out.write_chunk(coll_data, types["Collision Model"])
             
-        data += Sections.write_chunk(b'', types["Extension"])
+            out.write_chunk(b'', types["Extension"])
             
-        return Sections.write_chunk(data, types["Clump"])
+        return out
     
     #######################################################
-    def write_memory(self, version):
+    def write_memory(self, version, out=None):
 
-        data = b''
+        out = ChunkWriter.of(out)
         Sections.set_library_id(version, 0xFFFF)
 
-        data += self.write_uv_dict()
-        data += self.write_clump()
+        self.write_uv_dict(out)
+        self.write_clump(out)
 
-        return data
+        return out
             
     #######################################################
     def write_file(self, filename, version):
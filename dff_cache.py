@@ -0,0 +1,358 @@
+import os
+import hashlib
+import mmap
+from array import array
+from struct import unpack_from, pack, calcsize
+from sys import byteorder
+
+from .dff import (dff, DFFSection, Geometry, Material, Texture, UserData, Sections,
+                  ChunkWriter, MeshSplit, Vector, RGBA, TexCoords, Triangle,
+                  Sphere, GeomSurfPro)
+
+# Only what the map importer needs is stored in the cache
+CACHED_SECTIONS = DFFSection.GEOMETRY | DFFSection.MATERIALS | DFFSection.MESH_SPLIT
+
+MAGIC = b'UWDC'
+FORMAT_VERSION = 3
+
+# geometry content mask
+HAS_VERTICES  = 0x1
+HAS_NORMALS   = 0x2
+HAS_PRELIT    = 0x4
+HAS_MAT_SPLIT = 0x8
+
+HEADER_FORMAT   = "<4sI16sII"
+GEOMETRY_FORMAT = "<9I4f"
+MATERIAL_FORMAT = "<II4BII3f"
+TEXTURE_FORMAT  = "<II"
+
+def default_cache_dir():
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') \
+        or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'unware', 'dff')
+
+def _pack_bytes(out, data):
+    out.pack("<I", len(data))
+    out += data
+    out += bytes(-len(data) % 4)
+
+def _unpack_bytes(data, pos):
+    size = unpack_from("<I", data, pos)[0]
+    return bytes(data[pos + 4:pos + 4 + size]), pos + 4 + size + (-size % 4)
+
+def _pack_string(out, string):
+    _pack_bytes(out, string.encode('utf-8'))
+
+def _unpack_string(data, pos):
+    data, pos = _unpack_bytes(data, pos)
+    return str(data, 'utf-8'), pos
+
+def _unpack_indices(data, pos, count):
+    indices = array('I')
+    indices.frombytes(data[pos:pos + 4 * count])
+    if byteorder == 'big':
+        indices.byteswap()
+    return indices, pos + 4 * count
+
+class CachedMaterial(Material):
+
+    # Material read back from the cache, its plugins are only kept in
+    # serialized form
+    __slots__ = ['plugin_data']
+
+    def __init__(self):
+        super().__init__()
+        self.plugin_data = b''
+
+def _plugin_value(value):
+
+    # Plugin fields as plain nested tuples
+    if isinstance(value, Texture):
+        return (value.name, value.mask, value.filters, value.uv_addressing)
+    if isinstance(value, UserData):
+        return _plugin_value(value.sections)
+    if isinstance(value, (tuple, list)):
+        return tuple(_plugin_value(v) for v in value)
+    return value
+
+def plugin_data(material):
+
+    # Identity of the plugins of a material, equal for a parsed material and
+    # the same material read back from the cache. Built from the field
+    # values, the chunk writer isn't involved.
+    if isinstance(material, CachedMaterial):
+        return material.plugin_data
+    if not material.plugins:
+        return b''
+    return repr(sorted((key, _plugin_value(values))
+                       for key, values in material.plugins.items())).encode('utf-8')
+
+def pack_model(loader, digest=b''):
+
+    # Compact binary form of the geometries and materials of a loaded dff.
+    # Every block is 4 byte aligned so the file can be memory mapped.
+    out = ChunkWriter()
+    out.pack(HEADER_FORMAT, MAGIC, FORMAT_VERSION, digest,
+             loader.rw_version or 0, len(loader.geometry_list))
+
+    for geometry in loader.geometry_list:
+        mat_split = geometry.extensions.get('mat_split')
+        splits = geometry.extensions.get('mat_split_indices', [])
+
+        mask = 0
+        mask |= HAS_VERTICES * (len(geometry.vertices) > 0)
+        mask |= HAS_NORMALS * (len(geometry.normals) > 0)
+        mask |= HAS_PRELIT * (len(geometry.prelit_colors) > 0)
+        mask |= HAS_MAT_SPLIT * (mat_split is not None)
+
+        out.pack(GEOMETRY_FORMAT,
+                 geometry.flags or 0,
+                 len(geometry.vertices),
+                 len(geometry.triangles),
+                 len(geometry.uv_layers),
+                 mask,
+                 len(geometry.materials),
+                 len(mat_split) if mat_split is not None else 0,
+                 len(splits),
+                 geometry._num_vertices,
+                 *(geometry.bounding_sphere or (0, 0, 0, 0)))
+
+        out += Sections.write_array(Vector, geometry.vertices)
+        out += Sections.write_array(Vector, geometry.normals)
+        out += Sections.write_array(RGBA, geometry.prelit_colors)
+        for uv_layer in geometry.uv_layers:
+            out += Sections.write_array(TexCoords, uv_layer)
+        out += Sections.write_array(Triangle, geometry.triangles)
+
+        if mat_split is not None:
+            out += Sections.write_array(Triangle, mat_split, 'I')
+        for split in splits:
+            out.pack("<II", split.material, len(split.indices))
+            out += array('I', split.indices).tobytes() if byteorder == 'little' \
+                else pack("<%dI" % len(split.indices), *split.indices)
+
+        for material in geometry.materials:
+            surface_properties = material.surface_properties
+            out.pack(MATERIAL_FORMAT,
+                     material.flags or 0,
+                     surface_properties is not None,
+                     *(material.color or (255, 255, 255, 255)),
+                     material.is_textured or 0,
+                     len(material.textures),
+                     *(surface_properties or (0, 0, 0)))
+
+            for texture in material.textures:
+                out.pack(TEXTURE_FORMAT, texture.filters, texture.uv_addressing)
+                _pack_string(out, texture.name)
+                _pack_string(out, texture.mask)
+
+            _pack_bytes(out, plugin_data(material))
+
+    return out
+
+def unpack_model(data):
+
+    # Rebuilds a dff with the geometries and materials stored by pack_model,
+    # returns None if the data was written by another format version
+    data = memoryview(data)
+    magic, version, digest, rw_version, geometries_count = \
+        unpack_from(HEADER_FORMAT, data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        return None
+
+    loader = dff()
+    loader.rw_version = rw_version
+    pos = calcsize(HEADER_FORMAT)
+
+    for _ in range(geometries_count):
+        geometry = Geometry()
+
+        flags, vertices_count, triangles_count, uv_count, mask, \
+            materials_count, mat_split_count, splits_count, num_vertices, \
+            *sphere = unpack_from(GEOMETRY_FORMAT, data, pos)
+        pos += calcsize(GEOMETRY_FORMAT)
+
+        geometry.flags = flags
+        geometry._num_vertices = num_vertices
+        geometry._num_triangles = triangles_count
+        geometry.bounding_sphere = Sphere._make(sphere)
+        geometry.has_vertices = int(bool(mask & HAS_VERTICES))
+        geometry.has_normals = int(bool(mask & HAS_NORMALS))
+
+        geometry.vertices = Sections.read_array(Vector, data, pos, vertices_count)
+        pos += 12 * vertices_count
+
+        normals_count = vertices_count if mask & HAS_NORMALS else 0
+        geometry.normals = Sections.read_array(Vector, data, pos, normals_count)
+        pos += 12 * normals_count
+
+        prelit_count = vertices_count if mask & HAS_PRELIT else 0
+        geometry.prelit_colors = Sections.read_array(RGBA, data, pos, prelit_count)
+        pos += 4 * prelit_count
+
+        for _ in range(uv_count):
+            geometry.uv_layers.append(
+                Sections.read_array(TexCoords, data, pos, vertices_count)
+            )
+            pos += 8 * vertices_count
+
+        geometry.triangles = Sections.read_array(Triangle, data, pos, triangles_count)
+        pos += 8 * triangles_count
+
+        if mask & HAS_MAT_SPLIT:
+            geometry.extensions['mat_split'] = \
+                Sections.read_array(Triangle, data, pos, mat_split_count, 'I')
+            pos += 16 * mat_split_count
+
+            splits = []
+            for _ in range(splits_count):
+                material, count = unpack_from("<II", data, pos)
+                indices, pos = _unpack_indices(data, pos + 8, count)
+                splits.append(MeshSplit(material, indices))
+            geometry.extensions['mat_split_indices'] = splits
+
+        for _ in range(materials_count):
+            material = CachedMaterial()
+
+            material.flags, has_surface_properties, r, g, b, a, \
+                material.is_textured, textures_count, \
+                *surface_properties = unpack_from(MATERIAL_FORMAT, data, pos)
+            pos += calcsize(MATERIAL_FORMAT)
+
+            material.color = RGBA(r, g, b, a)
+            if has_surface_properties:
+                material.surface_properties = GeomSurfPro._make(surface_properties)
+
+            for _ in range(textures_count):
+                texture = Texture()
+                texture.filters, texture.uv_addressing = \
+                    unpack_from(TEXTURE_FORMAT, data, pos)
+                texture.name, pos = _unpack_string(data, pos + 8)
+                texture.mask, pos = _unpack_string(data, pos)
+                material.textures.append(texture)
+
+            material.plugin_data, pos = _unpack_bytes(data, pos)
+            geometry.materials.append(material)
+
+        loader.geometry_list.append(geometry)
+
+    return loader
+
+class DFFCache:
+
+    # Persistent cache of decoded dff files. Entries are keyed by the source
+    # path, size, mtime and content hash, and evicted least recently used
+    # first once the directory grows over max_size bytes. With max_size None
+    # entries are only written, size is left to another process.
+
+    def __init__(self, directory=None, max_size=512 * 1024 * 1024):
+        self.directory = directory or default_cache_dir()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+
+    def entry_path(self, path, stat, digest):
+        key = hashlib.blake2b(digest_size=20)
+        key.update(os.path.normcase(os.path.abspath(path)).encode('utf-8'))
+        key.update(pack("<QQ", stat.st_size, stat.st_mtime_ns))
+        key.update(digest)
+        return os.path.join(self.directory, key.hexdigest() + '.dffc')
+
+    def load_file(self, path):
+
+        # Returns the cached model, or parses the file and stores it
+        stat = os.stat(path)
+        with open(path, 'rb') as file:
+            content = file.read()
+
+        digest = hashlib.blake2b(content, digest_size=16).digest()
+        entry = self.entry_path(path, stat, digest)
+
+        loader = self.read_entry(entry)
+        if loader is not None:
+            self.hits += 1
+            return loader
+
+        self.misses += 1
+        loader = dff()
+        loader.load_memory(content, CACHED_SECTIONS)
+        loader.data = b''
+
+        self.write_entry(entry, pack_model(loader, digest))
+        return loader
+
+    def read_entry(self, entry):
+        try:
+            with open(entry, 'rb') as file:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    with memoryview(mm) as view:
+                        loader = unpack_model(view)
+
+            # mtime is used as the LRU timestamp
+            os.utime(entry)
+            return loader
+        except (OSError, ValueError, BufferError, UnicodeDecodeError):
+            return None
+
+    def write_entry(self, entry, data):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = entry + '.tmp'
+            with open(tmp, 'wb') as file:
+                file.write(data)
+            os.replace(tmp, entry)
+        except OSError:
+            return
+
+        if self.max_size is None:
+            return
+        if self._size is None:
+            self.trim()
+        else:
+            self._size += len(data)
+            if self._size > self.max_size:
+                self.evict()
+
+    def trim(self):
+
+        # Recounts the directory, e.g. after workers wrote to it
+        self._size = sum(size for _, size, _ in self.entries())
+        if self._size > self.max_size:
+            self.evict()
+
+    def entries(self):
+        result = []
+        try:
+            with os.scandir(self.directory) as it:
+                for e in it:
+                    if e.name.endswith('.dffc'):
+                        stat = e.stat()
+                        result.append((stat.st_mtime, stat.st_size, e.path))
+        except OSError:
+            pass
+        return result
+
+    def evict(self):
+
+        # Drop the least recently used entries until 90% of max_size is left
+        entries = sorted(self.entries())
+        self._size = sum(size for _, size, _ in entries)
+        target = self.max_size * 0.9
+
+        for _, size, path in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._size = 0
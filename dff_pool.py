@@ -0,0 +1,127 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from .dff import dff
+from .dff_cache import DFFCache, CACHED_SECTIONS, pack_model, unpack_model
+
+# Decoding dff files in worker processes. dff.py has no bpy dependency, so
+# workers only parse and hand back the compact pack_model buffers, the
+# Blender side work stays on the main thread.
+
+# Parse cache of a worker process, it only writes entries and leaves
+# size accounting and eviction to the parent
+_parse_cache = None
+
+def _init_worker(cache_dir):
+    global _parse_cache
+    if cache_dir is not None:
+        _parse_cache = DFFCache(cache_dir, None)
+
+# Run first in every worker. Extensions live in the bl_ext namespace that
+# Blender sets up at runtime, so a spawned interpreter can't import this
+# package by name. Its parents are stubbed and the package is loaded
+# straight from its directory under the same name, tasks pickled as
+# <package>.dff_pool.decode_file then resolve. The package __init__ skips
+# the Blender side without bpy.
+_WORKER_SETUP = """
+import os, sys, types, importlib, importlib.util
+parts = package.split('.')
+for i in range(1, len(parts)):
+    sys.modules.setdefault('.'.join(parts[:i]), types.ModuleType('.'.join(parts[:i])))
+if package not in sys.modules:
+    spec = importlib.util.spec_from_file_location(
+        package, os.path.join(directory, '__init__.py'), submodule_search_locations=[directory])
+    module = sys.modules[package] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+importlib.import_module(package + '.dff_pool')._init_worker(cache_dir)
+"""
+
+def decode_file(path):
+
+    # Runs in a worker, returns (packed model or None, parse cache hit)
+    try:
+        if _parse_cache is not None:
+            hits = _parse_cache.hits
+            loader = _parse_cache.load_file(path)
+            hit = _parse_cache.hits > hits
+        else:
+            loader = dff()
+            loader.load_file(path, CACHED_SECTIONS)
+            hit = False
+
+        if not loader.geometry_list:
+            return None, hit
+        return bytes(pack_model(loader)), hit
+
+    except Exception:
+        return None, False
+
+# Why the pool could not be started, it isn't tried again in the session
+_pool_error = None
+
+def pool_error():
+    return _pool_error
+
+def _decode_serial(paths, parse_cache):
+    results = {}
+    for path in paths:
+        try:
+            if parse_cache:
+                loader = parse_cache.load_file(path)
+            else:
+                loader = dff()
+                loader.load_file(path, CACHED_SECTIONS)
+                loader.data = b''
+        except Exception:
+            loader = None
+
+        results[path] = loader if loader and loader.geometry_list else None
+    return results
+
+def decode_files(paths, workers=0, parse_cache=None):
+
+    # Returns {path: dff or None}. workers=0 uses every core. Falls back to
+    # decoding in this process if a pool can't be started, e.g. when the
+    # add-on package can't be imported by a fresh interpreter, pool_error()
+    # then gives the reason.
+    global _pool_error
+    paths = list(paths)
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(paths))
+
+    if workers <= 1 or _pool_error:
+        return _decode_serial(paths, parse_cache)
+
+    setup = {
+        'package': __package__,
+        'directory': os.path.dirname(os.path.abspath(__file__)),
+        'cache_dir': parse_cache.directory if parse_cache else None,
+    }
+
+    results = {}
+    try:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(workers, mp_context=context,
+                                 initializer=exec, initargs=(_WORKER_SETUP, setup)) as pool:
+            decoded = pool.map(
+                decode_file,
+                paths,
+                chunksize=max(1, len(paths) // (workers * 4))
+            )
+            for path, (data, hit) in zip(paths, decoded):
+                results[path] = unpack_model(data) if data else None
+
+                if parse_cache and data:
+                    if hit:
+                        parse_cache.hits += 1
+                    else:
+                        parse_cache.misses += 1
+
+    except Exception as e:
+        _pool_error = str(e) or type(e).__name__
+        return _decode_serial(paths, parse_cache)
+
+    if parse_cache and parse_cache.max_size is not None:
+        parse_cache.trim()
+    return results
@@ -1,58 +1,454 @@
 import bpy
 import os
-import bmesh
-from mathutils import Quaternion # need to check
-from .dff import dff
+import re
+import hashlib
+from time import perf_counter
+import numpy as np
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from struct import unpack_from
+from mathutils import Quaternion, Matrix # need to check
+from .dff import dff, DFFSection, ElementArray
+from .dff_pool import decode_files, pool_error
+from .dff_cache import plugin_data
+from .asset_index import AssetIndex, TEXTURE_EXTENSIONS
+from .txd import txd
+from .ide import iter_sections
+from .spatial import SpatialGrid, offset_radius
 
+# material key -> bpy material, kept between imports unless scope is IMPORT
 material_cache = {}
+MATERIAL_SCOPES = ('IMPORT', 'SESSION', 'PERSISTENT')
 
-def parse_ipl(ipl_path):
-    objs = []
-    with open(ipl_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-        inside = False
-        for raw in lines:
-            line = raw.strip()
-            if line.lower() == 'inst':
-                inside = True
-                continue
-            if line.lower() == 'end':
-                inside = False
-                continue
-            if not inside or not line:
-                continue
-            if line.startswith('//') or '//' in line or line.startswith('#'):
-                continue
-            parts = [x.strip() for x in line.split(',')]
-            if len(parts) < 10:
+# The importer only builds meshes, everything else in the dff is skipped
+IMPORT_SECTIONS = DFFSection.GEOMETRY | DFFSection.MATERIALS | DFFSection.MESH_SPLIT
+
+# Compact IPL records, rot is (w, x, y, z). Binary IPLs have no model names.
+IplInst  = namedtuple("IplInst", "id model interior pos rot lod")
+IplEntry = namedtuple("IplEntry", "section fields")
+
+LOD_LEVELS = ('ALL', 'HD', 'LOD', 'FOCUS')
+INSTANCING_MODES = ('OBJECTS', 'COLLECTIONS', 'GEONODES')
+
+IPL_SECTIONS = {
+    'inst', 'cull', 'grge', 'enex', 'pick', 'cars', 'jump',
+    'tcyc', 'auzo', 'mult', 'zone', 'occl', 'path',
+}
+
+def _int(value, default=-1):
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+def _parse_inst(parts):
+    if len(parts) < 10:
+        return None
+    try:
+        return IplInst(
+            _int(parts[0]),
+            parts[1],
+            _int(parts[2]),
+            (float(parts[3]), float(parts[4]), float(parts[5])),
+            (float(parts[9]), float(parts[6]), float(parts[7]), float(parts[8])),
+            _int(parts[10]) if len(parts) > 10 else -1
+        )
+    except ValueError:
+        return None
+
+def iter_text_ipl(lines):
+
+    # Yields (section, record) for every entry of every known section,
+    # inst entries as IplInst and the others as IplEntry
+    for section, parts in iter_sections(lines, IPL_SECTIONS):
+        if section == 'inst':
+            inst = _parse_inst(parts)
+            if inst:
+                yield section, inst
+        else:
+            yield section, IplEntry(section, tuple(parts))
+
+def keep_instances(objs, keep):
+
+    # Drops the instances where keep is false, lod indices are moved along
+    # and point nowhere (-1) once their LOD is dropped
+    index = {}
+    result = []
+    for i, o in enumerate(objs):
+        if keep[i]:
+            index[i] = len(result)
+            result.append(o)
+    return [o if o.lod < 0 else o._replace(lod=index.get(o.lod, -1)) for o in result]
+
+def flatten_instances(groups):
+
+    # Joins the {path: instances} of parse_ipls into one list. lod is an
+    # index into its own IPL and becomes an index into the joined list.
+    result = []
+    for instances in groups.values():
+        base = len(result)
+        for o in instances:
+            if o.lod >= 0:
+                o = o._replace(lod=o.lod + base if o.lod < len(instances) else -1)
+            result.append(o)
+    return result
+
+def select_lod_level(objs, level='ALL', focus=(0.0, 0.0, 0.0), radius=300.0):
+
+    # ALL keeps everything, HD drops the LOD models, LOD drops every model
+    # that has a LOD. FOCUS keeps the full models within radius of focus
+    # and the LOD of those beyond it.
+    if level == 'ALL':
+        return objs
+
+    is_lod = [False] * len(objs)
+    for o in objs:
+        if o.lod >= 0:
+            is_lod[o.lod] = True
+
+    if level == 'HD':
+        keep = [not lod for lod in is_lod]
+    elif level == 'LOD':
+        keep = [o.lod < 0 for o in objs]
+    else:
+        fx, fy, fz = focus
+        radius2 = radius * radius
+        keep = [True] * len(objs)
+        needed = [False] * len(objs)
+        for i, o in enumerate(objs):
+            if o.lod < 0:
                 continue
-            obj = {
-                'id': parts[0],
-                'model': parts[1],
-                'interior': parts[2],
-                'pos': (float(parts[3]), float(parts[4]), float(parts[5])),
-                'rot': (float(parts[9]), float(parts[6]), float(parts[7]), float(parts[8])),
-                'lod': parts[10] if len(parts) > 10 else ''
-            }
-            objs.append(obj)
-    return objs
-
-def filter_triangles(verts, tris):
-    return [
-        tri for tri in tris
-        if not (tri.a >= len(verts) or tri.b >= len(verts) or tri.c >= len(verts)
-                or verts[tri.a] == verts[tri.b]
-                or verts[tri.b] == verts[tri.c]
-                or verts[tri.a] == verts[tri.c])
-    ]
-
-def get_or_create_material(mat_name, mat_data, dff_source, texture_dict):
+            x, y, z = o.pos
+            if (x - fx) ** 2 + (y - fy) ** 2 + (z - fz) ** 2 > radius2:
+                keep[i] = False
+                needed[o.lod] = True
+        for i, lod in enumerate(is_lod):
+            if lod and not needed[i]:
+                keep[i] = False
+
+    return keep_instances(objs, keep)
+
+def resolve_instances(objs, definitions, min_draw_distance=0.0, max_draw_distance=0.0, skip_flags=0):
+
+    # Names the models of binary IPL instances from their IDE id and drops
+    # instances filtered by draw distance or flags. Instances without a
+    # definition are kept, a draw distance of 0 is never filtered.
+    result = []
+    keep = []
+    for o in objs:
+        definition = definitions.get(o.id)
+        if definition is None:
+            keep.append(bool(o.model))
+        elif definition.flags & skip_flags:
+            keep.append(False)
+        elif definition.draw_distance and (definition.draw_distance < min_draw_distance or
+                (max_draw_distance and definition.draw_distance > max_draw_distance)):
+            keep.append(False)
+        else:
+            keep.append(True)
+            if not o.model:
+                o = o._replace(model=definition.model)
+        result.append(o)
+    return keep_instances(result, keep)
+
+def iter_binary_ipl(data):
+
+    # Streamed IPLs from gta3.img: 'bnry' header, 40 byte instances and
+    # 48 byte parked cars
+    data = memoryview(data)
+    inst_count, _, _, _, cars_count, _ = unpack_from("<6I", data, 4)
+    offsets = unpack_from("<12I", data, 28)
+
+    for pos in range(offsets[0], offsets[0] + inst_count * 40, 40):
+        x, y, z, rx, ry, rz, rw, model_id, interior, lod = \
+            unpack_from("<7f3i", data, pos)
+        yield 'inst', IplInst(model_id, None, interior, (x, y, z), (rw, rx, ry, rz), lod)
+
+    for pos in range(offsets[8], offsets[8] + cars_count * 48, 48):
+        yield 'cars', IplEntry('cars', unpack_from("<4f8i", data, pos))
+
+def iter_ipl_memory(data):
+    if bytes(data[:4]) == b'bnry':
+        return iter_binary_ipl(data)
+    return iter_text_ipl(str(data, 'utf-8', 'replace').splitlines())
+
+def iter_ipl(ipl_path):
+    with open(ipl_path, 'rb') as f:
+        if f.read(4) == b'bnry':
+            f.seek(0)
+            yield from iter_binary_ipl(f.read())
+            return
+
+    with open(ipl_path, 'r', encoding='utf-8', errors='replace') as f:
+        yield from iter_text_ipl(f)
+
+def parse_ipl(ipl_path):
+    return [record for section, record in iter_ipl(ipl_path) if section == 'inst']
+
+STREAM_NAME = re.compile(r'(.+)_stream\d+$')
+
+def stream_parent(ipl_path):
+
+    # Name of the text IPL a <name>_stream<n>.ipl belongs to, or None
+    match = STREAM_NAME.match(os.path.splitext(os.path.basename(ipl_path))[0].lower())
+    return match.group(1) if match else None
+
+def parse_stream_ipls(ipl_path, assets):
+
+    # Binary <name>_stream<n>.ipl files stored in the IMG archives belong
+    # to the text IPL of the same name
+    base = os.path.splitext(os.path.basename(ipl_path))[0]
+    instances = []
+    for i in range(256):
+        data = assets.entry("%s_stream%d" % (base, i), '.ipl')
+        if data is None:
+            break
+        if isinstance(data, str):
+            instances.extend(parse_ipl(data))
+        else:
+            instances.extend(r for s, r in iter_ipl_memory(data) if s == 'inst')
+    return instances
+
+def parse_ipls(ipl_paths, threads=0, assets=None):
+
+    # Reads several IPLs at once, returns {path: instances} in the given
+    # order. With an asset index their streamed parts are appended, stream
+    # IPLs whose text IPL is also given are left out so they aren't read
+    # twice with lod indices against the wrong list.
+    def parse(path):
+        instances = parse_ipl(path)
+        if assets is not None:
+            instances += parse_stream_ipls(path, assets)
+        return instances
+
+    ipl_paths = list(ipl_paths)
+    if assets is not None:
+        assets.open_archives()
+        names = {os.path.splitext(os.path.basename(p))[0].lower() for p in ipl_paths}
+        ipl_paths = [p for p in ipl_paths if stream_parent(p) not in names]
+    if len(ipl_paths) < 2 or threads == 1:
+        return {path: parse(path) for path in ipl_paths}
+
+    threads = threads or min(8, len(ipl_paths))
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return dict(zip(ipl_paths, pool.map(parse, ipl_paths)))
+
+def filter_triangles(verts, faces):
+
+    # verts is (n, 3) positions, faces is (t, 4) rows of a b c material.
+    # Drops faces with out of range indices, faces with two corners at the
+    # same position and repeated faces (same corners in any order), and
+    # returns the kept faces in their original order with the counts.
+    counts = {'out_of_range': 0, 'degenerate': 0, 'duplicate': 0}
+
+    corners = faces[:, :3]
+    valid = ((corners >= 0) & (corners < len(verts))).all(axis=1)
+    counts['out_of_range'] = int(len(faces) - valid.sum())
+    faces = faces[valid]
+
+    # Weld equal positions so that degenerate faces are found by index
+    if len(verts):
+        weld = np.unique(verts, axis=0, return_inverse=True)[1].ravel()
+        welded = weld[faces[:, :3]]
+        degenerate = (welded[:, 0] == welded[:, 1]) | \
+                     (welded[:, 1] == welded[:, 2]) | \
+                     (welded[:, 0] == welded[:, 2])
+        counts['degenerate'] = int(degenerate.sum())
+        faces = faces[~degenerate]
+
+    first = np.unique(np.sort(faces[:, :3], axis=1), axis=0, return_index=True)[1]
+    counts['duplicate'] = int(len(faces) - len(first))
+    faces = faces[np.sort(first)]
+
+    return faces, counts
+
+def _asset_files(dff_source, extensions):
+    if isinstance(dff_source, AssetIndex):
+        return dff_source.files
+
+    found = {}
+    try:
+        with os.scandir(dff_source) as it:
+            for e in it:
+                name, ext = os.path.splitext(e.name.lower())
+                if ext in extensions:
+                    found.setdefault(ext, {})[name] = e.path
+    except (OSError, TypeError):
+        pass
+    return found
+
+def texture_paths(dff_source):
+
+    # name -> file of every loose texture, earlier extensions win
+    found = _asset_files(dff_source, TEXTURE_EXTENSIONS)
+    paths = {}
+    for ext in reversed(TEXTURE_EXTENSIONS):
+        paths.update(found.get(ext, {}))
+    return paths
+
+def txd_paths(dff_source):
+
+    # name -> path, or archive view when the asset tree has IMG files
+    if isinstance(dff_source, AssetIndex):
+        return dff_source.entries('.txd')
+    return dict(_asset_files(dff_source, ('.txd',)).get('.txd', {}))
+
+def image_from_native(texture):
+
+    # Top level of a TXD texture as a packed Blender image
+    rgba = texture.to_rgba()
+    height, width = rgba.shape[:2]
+    image = bpy.data.images.new(texture.name, width, height, alpha=texture.has_alpha)
+
+    # Blender rows go bottom up
+    image.pixels.foreach_set((rgba[::-1].astype(np.float32) / 255).ravel())
+    image.pack()
+    return image
+
+class TextureIndex:
+
+    # Texture lookups for the length of one import. Loose files and images
+    # already in the file are keyed by name, textures read from a TXD by
+    # (txd, name) since TXDs often reuse names like "wall". Missing loose
+    # textures are remembered as None. Every TXD is read once, its textures
+    # are only decoded when used.
+
+    def __init__(self, paths=None, txds=None, txd_parents=None):
+        self.paths = paths or {}
+        self.txd_paths = txds or {}
+        self.txd_parents = txd_parents or {}
+        self.txds = {}
+        self.images = {}
+        for img in bpy.data.images:
+            source = img.get('unware_txd')
+            key = (source, img.get('unware_texture')) if source else img.name.lower()
+            self.images.setdefault(key, img)
+
+    def loose_image(self, name):
+        image = self.images.get(name)
+        if image is None and name not in self.images:
+            path = self.paths.get(name)
+            image = bpy.data.images.load(path, check_existing=True) if path else None
+            self.images[name] = image
+        return image
+
+    def resolve(self, name, txd_name=None):
+
+        # (txd, name) of the TXD supplying a texture, following txdp
+        # parents. txd is None for loose files, which take priority.
+        if self.loose_image(name) is not None:
+            return None, name
+        txd_name = txd_name.lower() if txd_name else None
+        for _ in range(8):
+            if not txd_name:
+                break
+            if name in self.txd_textures(txd_name):
+                return txd_name, name
+            txd_name = self.txd_parents.get(txd_name)
+        return None, name
+
+    def image(self, name, txd_name=None):
+        key = self.resolve(name, txd_name)
+        if key[0] is None:
+            return self.loose_image(name)
+
+        image = self.images.get(key)
+        if image is None and key not in self.images:
+            try:
+                image = image_from_native(self.txd_textures(key[0])[name])
+                image['unware_txd'], image['unware_texture'] = key
+            except Exception:
+                image = None
+            self.images[key] = image
+        return image
+
+    def forget(self, image):
+
+        # Drops an image about to be removed from the file
+        source = image.get('unware_txd')
+        if source:
+            key = (source, image.get('unware_texture'))
+            if self.images.get(key) == image:
+                del self.images[key]
+        else:
+            for key in [k for k, v in self.images.items() if v == image]:
+                del self.images[key]
+
+    def txd_textures(self, txd_name):
+        textures = self.txds.get(txd_name)
+        if textures is None:
+            textures = self.txds[txd_name] = {}
+            source = self.txd_paths.get(txd_name)
+            if source is not None:
+                loader = txd()
+                try:
+                    if isinstance(source, str):
+                        loader.load_file(source)
+                    else:
+                        loader.load_memory(source)
+                except Exception:
+                    pass
+                textures.update((t.name.lower(), t) for t in loader.textures)
+        return textures
+
+def material_key(mat_data, txd_name=None):
+
+    # Stable identity of a RenderWare material, equal keys give the same
+    # Blender material. txd_name is the TXD its texture is read from.
+    # Plugins are compared by their serialized form, which the parse cache
+    # keeps.
+    key = hashlib.blake2b(digest_size=16)
+    key.update(repr((
+        tuple(mat_data.color) if mat_data.color else None,
+        tuple(mat_data.surface_properties) if mat_data.surface_properties else None,
+        [(t.name.lower(), t.mask.lower(), t.filters, t.uv_addressing) for t in mat_data.textures],
+        txd_name,
+    )).encode('utf-8'))
+    key.update(plugin_data(mat_data))
+    return key.hexdigest()
+
+def _material_alive(bpy_mat):
+    try:
+        return bpy.data.materials.get(bpy_mat.name) == bpy_mat
+    except ReferenceError:
+        return False
+
+def reset_material_cache(scope='IMPORT'):
     global material_cache
-    cache_key = f"{mat_name}_{mat_data.color.r if mat_data.color else 0}"
+
+    if scope == 'IMPORT':
+        material_cache = {}
+    elif scope == 'SESSION':
+        # Forget materials that were deleted since the last import
+        material_cache = {k: m for k, m in material_cache.items() if _material_alive(m)}
+    else:
+        # Materials are tagged with their key, so they are found again
+        # after the blend file is saved and reopened
+        material_cache = {m['unware_key']: m for m in bpy.data.materials
+                          if 'unware_key' in m}
+
+def free_material(bpy_mat):
+
+    # Removes a material nothing uses any more, together with its cache
+    # entry. Returns the images its texture nodes used.
+    if bpy_mat.users:
+        return set()
+    images = {n.image for n in bpy_mat.node_tree.nodes if getattr(n, 'image', None)}
+    key = bpy_mat.get('unware_key')
+    if material_cache.get(key) == bpy_mat:
+        del material_cache[key]
+    bpy.data.materials.remove(bpy_mat)
+    return images
+
+def get_or_create_material(mat_name, mat_data, dff_source, textures, txd_name=None):
+    if mat_data.textures:
+        txd_name = textures.resolve(mat_data.textures[0].name.lower(), txd_name)[0]
+    cache_key = material_key(mat_data, txd_name if mat_data.textures else None)
     if cache_key in material_cache:
         return material_cache[cache_key]
 
     bpy_mat = bpy.data.materials.new(name=mat_name)
+    bpy_mat['unware_key'] = cache_key
     bpy_mat.use_nodes = True
     nodes = bpy_mat.node_tree.nodes
     links = bpy_mat.node_tree.links
@@ -70,13 +466,9 @@ def get_or_create_material(mat_name, mat_data, dff_source, texture_dict):
         tex_name = mat_data.textures[0].name.lower()
         tex_node = nodes.new("ShaderNodeTexImage")
         tex_node.name = tex_name
-        existing = next((img for img in bpy.data.images if img.name.lower()==tex_name), None)
-        if existing:
-            tex_node.image = existing
-        else:
-            tex_path = texture_dict.get(tex_name) or os.path.join(dff_source, f"{tex_name}.png")
-            if os.path.exists(tex_path):
-                tex_node.image = bpy.data.images.load(tex_path, check_existing=True)
+        image = textures.image(tex_name, txd_name)
+        if image:
+            tex_node.image = image
         links.new(tex_node.outputs["Color"], principled.inputs["Base Color"])
     elif mat_data.color:
         c = mat_data.color
@@ -85,81 +477,602 @@ def get_or_create_material(mat_name, mat_data, dff_source, texture_dict):
     material_cache[cache_key] = bpy_mat
     return bpy_mat
 
-def import_dff(model_name, dff_source, texture_dict=None):
-    texture_dict = texture_dict or {}
+class ImportCache:
+
+    # Per import state, every model is parsed and built only once and all of
+    # its instances share the same mesh datablock. models only holds dffs
+    # decoded ahead by decode_models until their mesh is built.
+
+    def __init__(self, parse_cache=None):
+        self.models = {}
+        self.meshes = {}
+        self.filtered = {}
+        self.hits = 0
+        self.misses = 0
+        self.parse_cache = parse_cache
+        self.textures = None
+        self.pool_error = None
+
+    def stats(self):
+        stats = {
+            'models': len(self.meshes),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+        for key in ('out_of_range', 'degenerate', 'duplicate'):
+            stats[key] = sum(counts[key] for counts in self.filtered.values())
+
+        # Models that lost the most faces, as (name, counts)
+        stats['worst'] = sorted(self.filtered.items(), key=lambda item: -sum(item[1].values()))[:5]
+        if self.pool_error:
+            stats['pool_error'] = self.pool_error
+        if self.parse_cache:
+            stats['disk_hits'] = self.parse_cache.hits
+            stats['disk_misses'] = self.parse_cache.misses
+        return stats
+
+def find_model(model_name, dff_source):
+
+    # dff_source is either an AssetIndex or a single folder. The result is
+    # a path, or a view when the model comes from an IMG archive.
+    if isinstance(dff_source, AssetIndex):
+        return dff_source.entry(model_name, '.dff')
+    path = os.path.join(dff_source, model_name + '.dff')
+    return path if os.path.exists(path) else None
+
+def load_dff(model_name, dff_source, parse_cache=None):
     loader = dff()
     try:
-        if isinstance(dff_source, str):
-            path = os.path.join(dff_source, model_name + '.dff')
-            if not os.path.exists(path): return None
-            loader.load_file(path)
+        if isinstance(dff_source, (str, AssetIndex)):
+            source = find_model(model_name, dff_source)
+            if source is None: return None
+            if not isinstance(source, str):
+                loader.load_memory(source, IMPORT_SECTIONS)
+            elif parse_cache:
+                loader = parse_cache.load_file(source)
+            else:
+                loader.load_file(source, IMPORT_SECTIONS)
         else:
-            loader.load_memory(dff_source)
+            loader.load_memory(dff_source, IMPORT_SECTIONS)
     except Exception:
         return None
 
     if not loader.geometry_list:
         return None
 
+    # Everything was decoded into its own arrays, don't keep the file around
+    loader.data = b''
+    return loader
+
+def element_array(elements, width, dtype):
+
+    # (n, width) numpy view of an ElementArray, or a copy of a namedtuple list
+    if isinstance(elements, ElementArray):
+        values = elements.values
+    else:
+        values = [v for element in elements for v in element]
+    return np.asarray(values, dtype=dtype).reshape(-1, width)
+
+def build_mesh(model_name, loader, dff_source, textures, counts=None, txd_name=None):
     geo = loader.geometry_list[0]
     tris = geo.extensions.get('mat_split', geo.triangles)
-    tris = filter_triangles(geo.vertices, tris)
+
+    # Triangle rows are b a material c
+    verts = element_array(geo.vertices, 3, np.float32)
+    faces = element_array(tris, 4, np.int64)[:, [1, 0, 3, 2]]
+    faces, filtered = filter_triangles(verts, faces)
+    if counts is not None:
+        counts.update(filtered)
+
+    faces = faces.astype(np.int32)
+    loops = faces[:, :3].ravel()
+
     mesh = bpy.data.meshes.new(model_name)
-    obj = bpy.data.objects.new(model_name, mesh)
-    bm = bmesh.new()
+    mesh.vertices.add(len(verts))
+    mesh.vertices.foreach_set("co", verts.ravel())
 
-    for v in geo.vertices:
-        bm.verts.new((v.x, v.y, v.z))
-    bm.verts.ensure_lookup_table()
-    uv_layers = [bm.loops.layers.uv.new(f"uv{i}") for i in range(len(geo.uv_layers))]
+    mesh.loops.add(len(loops))
+    mesh.loops.foreach_set("vertex_index", loops)
+
+    mesh.polygons.add(len(faces))
+    mesh.polygons.foreach_set("loop_start", np.arange(0, len(loops), 3, dtype=np.int32))
 
     if geo.materials:
         for i, mat in enumerate(geo.materials):
             mat_name = (mat.textures[0].name.lower() if mat.textures else f"{model_name}_mat_{i}")
-            bpy_mat = get_or_create_material(mat_name, mat, dff_source, texture_dict)
+            bpy_mat = get_or_create_material(mat_name, mat, dff_source, textures, txd_name or model_name)
             mesh.materials.append(bpy_mat)
+        mesh.polygons.foreach_set("material_index", faces[:, 3])
 
-    for tri in tris:
-        try:
-            face = bm.faces.new((bm.verts[tri.a], bm.verts[tri.b], bm.verts[tri.c]))
-            if geo.materials:
-                face.material_index = tri.material
-            for li, loop in enumerate(face.loops):
-                for ui, uv in enumerate(geo.uv_layers):
-                    luv = geo.uv_layers[ui][[tri.a,tri.b,tri.c][li]]
-                    loop[uv_layers[ui]].uv = (luv.u, 1-luv.v)
-        except ValueError:
-            continue
+    for i, layer in enumerate(geo.uv_layers):
+        uvs = element_array(layer, 2, np.float32)[loops]
+        uvs[:, 1] = 1 - uvs[:, 1]
+        mesh.uv_layers.new(name=f"uv{i}").data.foreach_set("uv", uvs.ravel())
 
-    bm.to_mesh(mesh); bm.free()
-    if uv_layers:
+    mesh.update()
+    mesh.validate(clean_customdata=False)
+    if geo.uv_layers:
         mesh.uv_layers.active = mesh.uv_layers[0]; mesh.uv_layers[0].name = "uvmap"
+    return mesh
+
+def import_dff(model_name, dff_source, texture_dict=None, cache=None, txd_name=None):
+
+    # Linked duplicate of an already built model
+    if cache is not None and model_name in cache.meshes:
+        cache.hits += 1
+        mesh = cache.meshes[model_name]
+        return bpy.data.objects.new(model_name, mesh) if mesh else None
+
+    if cache is not None and model_name in cache.models:
+        # Decoded up front by decode_models, not needed once built
+        loader = cache.models.pop(model_name)
+    else:
+        loader = load_dff(model_name, dff_source, cache.parse_cache if cache else None)
+    if cache is not None and cache.textures is not None:
+        textures = cache.textures
+    else:
+        textures = TextureIndex({**texture_paths(dff_source), **(texture_dict or {})},
+                                txd_paths(dff_source))
+        if cache is not None:
+            cache.textures = textures
+
+    counts = {}
+    mesh = build_mesh(model_name, loader, dff_source, textures, counts, txd_name) if loader else None
+
+    # Keep track of broken assets, reported in the import stats
+    if cache is not None:
+        if any(counts.values()):
+            cache.filtered[model_name] = counts
+        cache.misses += 1
+        cache.meshes[model_name] = mesh
+
+    if not mesh:
+        return None
+    return bpy.data.objects.new(model_name, mesh)
+
+def decode_models(model_names, dff_folder, cache, workers=0):
+
+    # Parses every model up front in a process pool, only the mesh building
+    # is left for the main thread. Archive entries are read on import.
+    paths = {}
+    for name in model_names:
+        if name in cache.models or name in cache.meshes:
+            continue
+        path = find_model(name, dff_folder)
+        if isinstance(path, str):
+            paths[path] = name
+
+    decoded = decode_files(paths, workers, cache.parse_cache)
+    for path, loader in decoded.items():
+        cache.models[paths[path]] = loader
+    cache.pool_error = pool_error()
+
+def instance_matrix(o):
+    w, x, y, z = o.rot
+    return Matrix.Translation(o.pos) @ Quaternion((-w, x, y, z)).to_matrix().to_4x4()
+
+def scan_radius(name, dff_source, scanner=None):
+
+    # Bounding radius of a model around its origin, only the dff headers
+    # are decoded
+    radius = 0.0
+    try:
+        scanner = scanner or dff()
+        source = find_model(name, dff_source)
+        if isinstance(source, str):
+            header = scanner.scan_file(source)
+        else:
+            header = scanner.scan_memory(source) if source is not None else None
+        for geometry in header.geometries if header else ():
+            if geometry.bounding_sphere:
+                x, y, z, r = geometry.bounding_sphere
+                radius = max(radius, offset_radius(r, (x, y, z)))
+    except Exception:
+        pass
+    return radius
+
+def model_radius(name, dff_source, scanner=None):
+
+    # Radius saved in the asset index, scanned and saved the first time
+    radius = dff_source.radius(name) if isinstance(dff_source, AssetIndex) else None
+    if radius is None:
+        radius = scan_radius(name, dff_source, scanner)
+        if isinstance(dff_source, AssetIndex):
+            dff_source.set_radius(name, radius)
+    return radius
+
+def model_radii(model_names, dff_source):
+    scanner = dff()
+    radii = {name: model_radius(name, dff_source, scanner) for name in model_names}
+    if isinstance(dff_source, AssetIndex):
+        dff_source.write_radii()
+    return radii
+
+def known_radii(model_names, dff_source):
+
+    # Only the radii already saved, nothing is scanned
+    if not isinstance(dff_source, AssetIndex):
+        return {}
+    radii = {}
+    for name in model_names:
+        radius = dff_source.radius(name)
+        if radius is not None:
+            radii[name] = radius
+    return radii
+
+def build_grid(objs, radii, cell_size=100.0):
+    return SpatialGrid(cell_size).build((o.pos for o in objs),
+                                        (radii.get(o.model, 0.0) for o in objs))
+
+# Bound on model radii for region queries, the largest SA models (LOD
+# terrain) are a few hundred metres across
+MAX_MODEL_RADIUS = 500.0
+
+def query_region(grid, region):
+    if region[0] == 'BOX':
+        return grid.query_box(region[1], region[2])
+    if region[0] == 'RADIUS':
+        return grid.query_sphere(region[1], region[2])
+    return grid.query_frustum(region[1])
+
+def grow_region(region, margin):
+    if region[0] == 'BOX':
+        return ('BOX', tuple(v - margin for v in region[1]), tuple(v + margin for v in region[2]))
+    if region[0] == 'RADIUS':
+        return ('RADIUS', region[1], region[2] + margin)
+    return ('FRUSTUM', [(nx, ny, nz, d + margin) for nx, ny, nz, d in region[1]])
+
+def select_region(objs, dff_source, region=None, cell_size=100.0):
+
+    # region is ('BOX', min, max), ('RADIUS', center, radius) or
+    # ('FRUSTUM', planes), instances whose bounds touch it are kept.
+    # Positions are queried first with the region grown by MAX_MODEL_RADIUS,
+    # radii are only read for the models of those candidates.
+    if not region:
+        return objs
+
+    points = SpatialGrid(cell_size).build((o.pos for o in objs), [0.0] * len(objs))
+    candidates = query_region(points, grow_region(region, MAX_MODEL_RADIUS))
+    near = [objs[i] for i in candidates]
+
+    radii = model_radii({o.model for o in near if o.model}, dff_source)
+    keep = [False] * len(objs)
+    for j in query_region(build_grid(near, radii, cell_size), region):
+        keep[candidates[j]] = True
+    return keep_instances(objs, keep)
+
+def new_import_cache(dff_folder, parse_cache=None, definitions=None):
+    cache = ImportCache(parse_cache)
+    cache.textures = TextureIndex(texture_paths(dff_folder), txd_paths(dff_folder),
+                                  definitions.txd_parents if definitions else None)
+    return cache
+
+def set_transform(inst, o):
+    xg, yg, zg = o.pos
+    inst.location = (xg, yg, zg)
+
+    w, x, y, z = o.rot
+    q = Quaternion((-w, x, y, z))
+    inst.rotation_mode = 'QUATERNION'
+    inst.rotation_quaternion = q
+
+    inst['id'] = o.id
+    inst['interior'] = o.interior
+    inst['lod'] = o.lod
+    return inst
+
+def create_instance(o, dff_folder, cache, definitions=None):
+
+    # Object for one IPL instance, not linked to any collection yet
+    if not o.model:
+        return None
+    txd_name = definitions.txd(o.id, o.model) if definitions else None
+    inst = import_dff(o.model, dff_folder, cache=cache, txd_name=txd_name)
+    if not inst:
+        return None
+    return set_transform(inst, o)
+
+def model_collections(models, dff_folder, cache, definitions=None):
+
+    # One collection per model holding its object at the origin, all of
+    # them inside an "unware models" collection excluded from the view
+    # layer. Names carry the index so Collection Info sorts them in order.
+    # models is {model: IDE id}.
+    parent = bpy.data.collections.new("unware models")
+    bpy.context.scene.collection.children.link(parent)
+    layer = bpy.context.view_layer.layer_collection.children.get(parent.name)
+    if layer:
+        layer.exclude = True
+
+    collections = {}
+    for model in sorted(models):
+        txd_name = definitions.txd(models[model], model) if definitions else None
+        source = import_dff(model, dff_folder, cache=cache, txd_name=txd_name)
+        if not source:
+            continue
+        collection = bpy.data.collections.new("%05d_%s" % (len(collections), model))
+        parent.children.link(collection)
+        collection.objects.link(source)
+        collections[model] = (len(collections), collection)
+    return parent, collections
+
+def collection_instance(o, collections):
+    if o.model not in collections:
+        return None
+    inst = bpy.data.objects.new(o.model, None)
+    inst.instance_type = 'COLLECTION'
+    inst.instance_collection = collections[o.model][1]
+    return set_transform(inst, o)
+
+def instancer_node_group(parent):
+
+    # Instance on Points picking the child collection of parent given by
+    # the "model" point attribute, rotated by the "rotation" attribute
+    tree = bpy.data.node_groups.new("unware instancer", 'GeometryNodeTree')
+    tree.interface.new_socket(name="Geometry", in_out='INPUT', socket_type='NodeSocketGeometry')
+    tree.interface.new_socket(name="Geometry", in_out='OUTPUT', socket_type='NodeSocketGeometry')
+
+    nodes = tree.nodes
+    links = tree.links
+    group_in = nodes.new('NodeGroupInput')
+    group_out = nodes.new('NodeGroupOutput')
+
+    info = nodes.new('GeometryNodeCollectionInfo')
+    info.transform_space = 'ORIGINAL'
+    info.inputs['Collection'].default_value = parent
+    info.inputs['Separate Children'].default_value = True
+    info.inputs['Reset Children'].default_value = True
+
+    model = nodes.new('GeometryNodeInputNamedAttribute')
+    model.data_type = 'INT'
+    model.inputs['Name'].default_value = "model"
+
+    rotation = nodes.new('GeometryNodeInputNamedAttribute')
+    rotation.data_type = 'FLOAT_VECTOR'
+    rotation.inputs['Name'].default_value = "rotation"
+
+    points = nodes.new('GeometryNodeInstanceOnPoints')
+    points.inputs['Pick Instance'].default_value = True
+
+    links.new(group_in.outputs[0], points.inputs['Points'])
+    links.new(info.outputs['Instances'], points.inputs['Instance'])
+    links.new(model.outputs['Attribute'], points.inputs['Instance Index'])
+    links.new(rotation.outputs['Attribute'], points.inputs['Rotation'])
+    links.new(points.outputs['Instances'], group_out.inputs[0])
+    return tree
+
+def point_instancer(objs, parent, collections, name="unware instances"):
+
+    # A single object with one point per instance driving a geometry
+    # nodes instancer, rotation is stored as euler angles
+    points = [(o, collections[o.model][0]) for o in objs if o.model in collections]
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(points))
+    mesh.vertices.foreach_set("co", np.array([o.pos for o, _ in points], dtype=np.float32).ravel())
+
+    rotations = [Quaternion((-o.rot[0], o.rot[1], o.rot[2], o.rot[3])).to_euler() for o, _ in points]
+    attribute = mesh.attributes.new("rotation", 'FLOAT_VECTOR', 'POINT')
+    attribute.data.foreach_set("vector", np.array(rotations, dtype=np.float32).ravel())
+    attribute = mesh.attributes.new("model", 'INT', 'POINT')
+    attribute.data.foreach_set("value", np.array([index for _, index in points], dtype=np.int32))
+
+    obj = bpy.data.objects.new(name, mesh)
+    modifier = obj.modifiers.new("instances", 'NODES')
+    modifier.node_group = instancer_node_group(parent)
+    bpy.context.collection.objects.link(obj)
     return obj
 
-def place_objects(objs, dff_folder):
-    global material_cache
-    material_cache = {}
+def place_objects(objs, dff_folder, parse_cache=None, workers=1, material_scope='IMPORT',
+                  definitions=None, instancing='OBJECTS'):
+
+    # lod is an index into objs, full models are parented to their LOD.
+    # OBJECTS gives every instance its own object sharing the model mesh,
+    # COLLECTIONS places collection instances of one collection per model
+    # and GEONODES a single point cloud instancing those collections.
+    reset_material_cache(material_scope)
+    materials = len(material_cache)
+    cache = new_import_cache(dff_folder, parse_cache, definitions)
+    if workers != 1:
+        decode_models({o.model for o in objs if o.model}, dff_folder, cache, workers)
+    placed = [None] * len(objs)
     bpy.context.scene.collection.hide_viewport = True
     try:
-        for o in objs:
-            inst = import_dff(o['model'], dff_folder)
-            if not inst: continue
-
-            xg, yg, zg = o['pos']
-            inst.location = (xg, yg, zg)
+        if instancing != 'OBJECTS':
+            models = {o.model: o.id for o in objs if o.model}
+            parent, collections = model_collections(models, dff_folder, cache, definitions)
 
-            w, x, y, z = o['rot']
-            q = Quaternion((-w, x, y, z))
-            inst.rotation_mode = 'QUATERNION'
-            inst.rotation_quaternion = q
+        if instancing == 'GEONODES':
+            point_instancer(objs, parent, collections)
+        else:
+            for i, o in enumerate(objs):
+                if instancing == 'COLLECTIONS':
+                    inst = collection_instance(o, collections)
+                else:
+                    inst = create_instance(o, dff_folder, cache, definitions)
+                if not inst: continue
+                bpy.context.collection.objects.link(inst)
+                placed[i] = inst
 
-            inst['id'] = int(o['id']) if o['id'].isdigit() else -1
-            inst['interior'] = int(o['interior']) if o['interior'].isdigit() else -1
-            try:
-                inst['lod'] = int(o['lod'])
-            except:
-                inst['lod'] = -1
-            bpy.context.collection.objects.link(inst)
+        for i, o in enumerate(objs):
+            if o.lod >= 0 and placed[i] and placed[o.lod]:
+                placed[i].parent = placed[o.lod]
+                placed[i].matrix_parent_inverse = instance_matrix(objs[o.lod]).inverted()
     finally:
         bpy.context.scene.collection.hide_viewport = False
         bpy.context.view_layer.update()
+    stats = cache.stats()
+    stats['materials'] = len(material_cache) - materials
+    return stats
+
+class StreamLoader:
+
+    # Keeps the instances within radius of a moving point loaded. Work is
+    # done in step() a little at a time so it can run from a timer, nearest
+    # instances first. Every placed model is reference counted, once its
+    # last instance goes the mesh is freed too. The materials and TXDs of a
+    # model are counted per model using them and freed the same way, with
+    # the images no material uses. Models without a saved radius start out
+    # as points in the grid and are scanned with whatever budget is left.
+
+    def __init__(self, objs, dff_folder, collection, radius=500.0, cell_size=100.0,
+                 parse_cache=None, definitions=None, material_scope='IMPORT'):
+        reset_material_cache(material_scope)
+        self.objs = objs
+        self.dff_folder = dff_folder
+        self.collection = collection
+        self.radius = radius
+        self.definitions = definitions
+        models = {o.model for o in objs if o.model}
+        radii = known_radii(models, dff_folder)
+        self.grid = build_grid(objs, radii, cell_size)
+        self.unknown = sorted(models.difference(radii))
+        self.instances = {}
+        self.cache = new_import_cache(dff_folder, parse_cache, definitions)
+        self.placed = {}
+        self.failed = set()
+        self.refs = {}
+        self.assets = {}
+        self.material_refs = {}
+        self.txd_refs = {}
+        self.children = {}
+        self.pending = []
+        self.unload = []
+        self.center = None
+
+        for i, o in enumerate(objs):
+            if o.lod >= 0:
+                self.children.setdefault(o.lod, []).append(i)
+            if o.model and o.model not in radii:
+                self.instances.setdefault(o.model, []).append(i)
+
+    def update(self, center):
+
+        # Instances are dropped a bit further out than they are loaded, so
+        # small moves don't load and unload the same models over and over
+        self.center = tuple(center)
+        wanted = self.grid.query_sphere(self.center, self.radius)
+        keep = set(self.grid.query_sphere(self.center, self.radius * 1.25))
+
+        cx, cy, cz = self.center
+        def distance(i):
+            x, y, z = self.objs[i].pos
+            return (x - cx) ** 2 + (y - cy) ** 2 + (z - cz) ** 2
+
+        # Nearest last, pending is popped from the end
+        self.pending = sorted((i for i in wanted if i not in self.placed and i not in self.failed),
+                              key=distance, reverse=True)
+        self.unload = [i for i in self.placed if i not in keep]
+
+    def step(self, budget_ms=10.0):
+
+        # Returns True while there is work left
+        deadline = perf_counter() + budget_ms / 1000
+        while self.unload:
+            self.remove(self.unload.pop())
+            if perf_counter() > deadline:
+                return True
+
+        while self.pending and perf_counter() < deadline:
+            self.add(self.pending.pop())
+
+        grown = False
+        while self.unknown and perf_counter() < deadline:
+            model = self.unknown.pop()
+            radius = model_radius(model, self.dff_folder)
+            for i in self.instances.pop(model):
+                self.grid.grow(i, radius)
+            grown = True
+
+        if grown:
+            if not self.unknown and isinstance(self.dff_folder, AssetIndex):
+                self.dff_folder.write_radii()
+            if self.center is not None:
+                self.update(self.center)
+        return bool(self.pending or self.unload or self.unknown)
+
+    def add(self, i):
+        o = self.objs[i]
+        inst = create_instance(o, self.dff_folder, self.cache, self.definitions)
+        if not inst:
+            # Not looked up again on later updates
+            self.failed.add(i)
+            return
+        self.collection.objects.link(inst)
+        self.placed[i] = inst
+        self.refs[o.model] = self.refs.get(o.model, 0) + 1
+        if self.refs[o.model] == 1:
+            self.hold(o)
+
+        # Link up with whichever of the LOD and its full models came first
+        lod = self.placed.get(o.lod) if o.lod >= 0 else None
+        if lod:
+            inst.parent = lod
+            inst.matrix_parent_inverse = instance_matrix(self.objs[o.lod]).inverted()
+        for child in self.children.get(i, ()):
+            if child in self.placed:
+                self.placed[child].parent = inst
+                self.placed[child].matrix_parent_inverse = instance_matrix(o).inverted()
+
+    def remove(self, i):
+        inst = self.placed.pop(i, None)
+        if inst is None:
+            return
+        model = self.objs[i].model
+        bpy.data.objects.remove(inst, do_unlink=True)
+
+        self.refs[model] -= 1
+        if self.refs[model] == 0:
+            del self.refs[model]
+            mesh = self.cache.meshes.pop(model, None)
+            if mesh and mesh.users == 0:
+                bpy.data.meshes.remove(mesh)
+            self.release(model)
+
+    def hold(self, o):
+
+        # Materials of the model's mesh and every TXD its textures can come
+        # from, the model's own and its txdp parents
+        mesh = self.cache.meshes.get(o.model)
+        materials = {m for m in mesh.materials if m} if mesh else set()
+
+        txds = set()
+        textures = self.cache.textures
+        txd_name = (self.definitions.txd(o.id, o.model) if self.definitions else None) or o.model
+        txd_name = txd_name.lower()
+        while txd_name and txd_name not in txds and len(txds) < 8:
+            txds.add(txd_name)
+            txd_name = textures.txd_parents.get(txd_name)
+
+        self.assets[o.model] = (materials, txds)
+        for m in materials:
+            self.material_refs[m] = self.material_refs.get(m, 0) + 1
+        for t in txds:
+            self.txd_refs[t] = self.txd_refs.get(t, 0) + 1
+
+    def release(self, model):
+        materials, txds = self.assets.pop(model, ((), ()))
+        textures = self.cache.textures
+
+        images = set()
+        for m in materials:
+            self.material_refs[m] -= 1
+            if self.material_refs[m] == 0:
+                del self.material_refs[m]
+                images |= free_material(m)
+        for image in images:
+            if image.users == 0:
+                textures.forget(image)
+                bpy.data.images.remove(image)
+
+        # The TXD's decoded textures and the archive bytes they hold
+        for t in txds:
+            self.txd_refs[t] -= 1
+            if self.txd_refs[t] == 0:
+                del self.txd_refs[t]
+                textures.txds.pop(t, None)
+
+    def clear(self):
+        self.pending = []
+        self.unload = []
+        for i in list(self.placed):
+            self.remove(i)
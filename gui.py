@@ -3,7 +3,14 @@ import os
 import zipfile
 import tempfile
 import re
-from .gta_sa_ipl_importer import parse_ipl, place_objects
+import mathutils
+from bpy.app.handlers import persistent
+from .gta_sa_ipl_importer import (parse_ipls, place_objects, resolve_instances,
+                                  flatten_instances, select_lod_level, select_region,
+                                  StreamLoader)
+from .dff_cache import DFFCache
+from .asset_index import get_index, forget_index
+from .ide import get_definitions
 from . import snapshoot as snapshoot_module
 
 def scan_ipl_files(root):
@@ -15,12 +22,61 @@ def scan_ipl_files(root):
     return files
 
 def find_dff_folder(root):
-    for dp, _, names in os.walk(root):
-        for f in names:
-            if f.lower().endswith('.dff'):
-                return dp
+    index = get_index(root).wait()
+    for path in index.names('.dff').values():
+        return os.path.dirname(path)
     return ''
 
+def camera_planes(scene):
+
+    # Inward facing (nx, ny, nz, d) planes of the active camera's view volume
+    cam = scene.camera
+    matrix = cam.matrix_world
+    origin = matrix.translation
+    forward = (matrix.to_3x3() @ mathutils.Vector((0.0, 0.0, -1.0))).normalized()
+    corners = [matrix @ v for v in cam.data.view_frame(scene=scene)]
+    inside = sum(corners, mathutils.Vector()) / 4 + forward * cam.data.clip_start
+
+    planes = []
+    for a, b in zip(corners, corners[1:] + corners[:1]):
+        direction = forward if cam.data.type == 'ORTHO' else a - origin
+        normal = (b - a).cross(direction).normalized()
+        if normal.dot(inside - a) < 0:
+            normal = -normal
+        planes.append((*normal, -normal.dot(a)))
+
+    near = origin + forward * cam.data.clip_start
+    far = origin + forward * cam.data.clip_end
+    planes.append((*forward, -forward.dot(near)))
+    planes.append((*(-forward), forward.dot(far)))
+    return planes
+
+def selected_ipl_paths(props):
+    if props.ipl_mode == 'ALL':
+        ipl_paths = [it.path for it in props.ipl_items]
+    elif props.ipl_mode == 'SELECTED':
+        ipl_paths = [it.path for it in props.ipl_items if it.selected]
+    else:
+        ipl_paths = [props.ipl_enum]
+    return [p for p in ipl_paths if os.path.exists(p)]
+
+def collect_instances(context, props, ipl_paths, assets):
+
+    # Parsed, LOD selected and IDE filtered instances of the chosen IPLs
+    definitions = get_definitions(assets)
+    objs = flatten_instances(parse_ipls(ipl_paths, assets=assets))
+    objs = select_lod_level(objs, props.lod_level, tuple(context.scene.cursor.location),
+                            props.lod_radius)
+    objs = resolve_instances(objs, definitions, props.min_draw_distance,
+                             props.max_draw_distance, props.skip_flags)
+    return objs, definitions
+
+def make_parse_cache(props):
+    if not props.parse_cache:
+        return None
+    return DFFCache(bpy.path.abspath(props.parse_cache_path) or None,
+                    props.parse_cache_size * 1024 * 1024)
+
 def safe_name(n):
     return re.sub(r'[^a-z0-9_\\-]', '_', n.lower())
 
@@ -28,6 +84,11 @@ def safe_name(n):
 class autoscan_ipl_item(bpy.types.PropertyGroup):
     path: bpy.props.StringProperty()
     name: bpy.props.StringProperty()
+    selected: bpy.props.BoolProperty(default=False)
+
+class autoscan_ipl_list(bpy.types.UIList):
+    def draw_item(self, context, layout, data, item, icon, active_data, active_propname):
+        layout.prop(item, "selected", text=item.name)
 
 class autoscan_props(bpy.types.PropertyGroup):
     root_path: bpy.props.StringProperty(
@@ -44,6 +105,14 @@ class autoscan_props(bpy.types.PropertyGroup):
         name="ipl",
         items=lambda self, ctx: [(it.path, it.name, "") for it in self.ipl_items] if self.ipl_items else []
     )
+    ipl_index: bpy.props.IntProperty()
+    ipl_mode: bpy.props.EnumProperty(
+        name="import",
+        items=[('ONE', 'one', 'import the chosen ipl'),
+               ('SELECTED', 'selection', 'import every ticked ipl'),
+               ('ALL', 'all', 'import every ipl under root')],
+        default='ONE'
+    )
     preserve_transforms: bpy.props.BoolProperty(
         name="preserve transforms",
         description="keep world position and rotation during export",
@@ -59,6 +128,112 @@ class autoscan_props(bpy.types.PropertyGroup):
         description="clear scene before import (recommended)",
         default=True
     )
+    workers: bpy.props.IntProperty(
+        name="workers",
+        description="processes used to decode dff files (0 = all cores, 1 = no pool)",
+        default=1,
+        min=0
+    )
+    lod_level: bpy.props.EnumProperty(
+        name="level",
+        items=[('ALL', 'all', 'import full and lod models, full models are parented to their lod'),
+               ('HD', 'full only', 'skip lod models'),
+               ('LOD', 'lod only', 'skip models that have a lod'),
+               ('FOCUS', 'full near cursor', 'full models near the 3d cursor, lod models beyond')],
+        default='ALL'
+    )
+    lod_radius: bpy.props.FloatProperty(
+        name="radius",
+        description="distance from the 3d cursor that gets full models",
+        default=300.0,
+        min=0.0
+    )
+    region_mode: bpy.props.EnumProperty(
+        name="region",
+        items=[('NONE', 'everything', 'import every instance'),
+               ('BOX', 'box', 'instances inside a box'),
+               ('CURSOR', 'around cursor', 'instances within a radius of the 3d cursor'),
+               ('CAMERA', 'camera view', 'instances seen by the scene camera')],
+        default='NONE'
+    )
+    region_min: bpy.props.FloatVectorProperty(
+        name="min",
+        size=3,
+        default=(-250.0, -250.0, -100.0)
+    )
+    region_max: bpy.props.FloatVectorProperty(
+        name="max",
+        size=3,
+        default=(250.0, 250.0, 500.0)
+    )
+    region_radius: bpy.props.FloatProperty(
+        name="radius",
+        description="distance from the 3d cursor to import",
+        default=250.0,
+        min=0.0
+    )
+    stream_radius: bpy.props.FloatProperty(
+        name="stream radius",
+        description="instances within this distance of the view are kept loaded",
+        default=400.0,
+        min=10.0
+    )
+    stream_budget: bpy.props.FloatProperty(
+        name="budget (ms)",
+        description="time spent loading per timer tick",
+        default=15.0,
+        min=1.0,
+        max=500.0
+    )
+    streaming: bpy.props.BoolProperty(default=False)
+    min_draw_distance: bpy.props.FloatProperty(
+        name="min draw distance",
+        description="skip objects whose ide draw distance is shorter (0 = keep all)",
+        default=0.0,
+        min=0.0
+    )
+    max_draw_distance: bpy.props.FloatProperty(
+        name="max draw distance",
+        description="skip objects whose ide draw distance is longer (0 = keep all)",
+        default=0.0,
+        min=0.0
+    )
+    skip_flags: bpy.props.IntProperty(
+        name="skip flags",
+        description="skip objects with any of these ide flags set",
+        default=0,
+        min=0
+    )
+    instancing: bpy.props.EnumProperty(
+        name="instancing",
+        items=[('OBJECTS', 'objects', 'one object per instance sharing the model mesh'),
+               ('COLLECTIONS', 'collections', 'one collection per model, instances are collection instances'),
+               ('GEONODES', 'geometry nodes', 'one point per instance driving a geometry nodes instancer')],
+        default='OBJECTS'
+    )
+    material_scope: bpy.props.EnumProperty(
+        name="materials",
+        items=[('IMPORT', 'per import', 'share materials within one import'),
+               ('SESSION', 'per session', 'reuse materials from earlier imports'),
+               ('PERSISTENT', 'persistent', 'reuse any imported material in the blend file')],
+        default='IMPORT'
+    )
+    parse_cache: bpy.props.BoolProperty(
+        name="parse cache",
+        description="keep decoded dff files on disk so re-imports skip parsing",
+        default=False
+    )
+    parse_cache_path: bpy.props.StringProperty(
+        name="cache folder",
+        description="where the parse cache is stored (empty = user cache folder)",
+        subtype='DIR_PATH'
+    )
+    parse_cache_size: bpy.props.IntProperty(
+        name="cache size (mb)",
+        description="oldest entries are removed once the cache grows past this size",
+        default=512,
+        min=16
+    )
     snap_mode: bpy.props.EnumProperty(
         name="snap mode",
         items=[('OBJECT', 'OBJECT', 'auto camera'), ('CAR', 'CAR', 'static car camera')],
@@ -96,6 +271,9 @@ class autoscan_props(bpy.types.PropertyGroup):
     def update_list(self):
         self.ipl_items.clear()
         if os.path.isdir(self.root_path):
+            # Start indexing right away, it is done by the time import is pressed
+            forget_index(self.root_path)
+            get_index(self.root_path)
             for p, n in scan_ipl_files(self.root_path):
                 it = self.ipl_items.add()
                 it.path, it.name = p, n
@@ -109,20 +287,37 @@ class import_autoscan_ipl_operator(bpy.types.Operator):
     bl_label = "import ipl"
     def execute(self, context):
         props = context.scene.autoscan_props
+
+        # Taken before optimize deletes the camera
+        region = None
+        if props.region_mode == 'BOX':
+            region = ('BOX', tuple(props.region_min), tuple(props.region_max))
+        elif props.region_mode == 'CURSOR':
+            region = ('RADIUS', tuple(context.scene.cursor.location), props.region_radius)
+        elif props.region_mode == 'CAMERA':
+            if not context.scene.camera:
+                self.report({'ERROR'}, "scene has no camera")
+                return {'CANCELLED'}
+            region = ('FRUSTUM', camera_planes(context.scene))
+
         if props.optimize:
             bpy.ops.object.select_all(action='SELECT')
             bpy.ops.object.delete()
 
-        ipl_path = props.ipl_enum
-        if not os.path.exists(ipl_path):
+        ipl_paths = selected_ipl_paths(props)
+        if not ipl_paths:
             self.report({'ERROR'}, "ipl file not found")
             return {'CANCELLED'}
-        dff_folder = find_dff_folder(props.root_path)
-        if not dff_folder:
-            self.report({'ERROR'}, "dff folder not found")
+        assets = get_index(props.root_path).wait()
+        if not assets.names('.dff') and not assets.names('.img'):
+            self.report({'ERROR'}, "no dff files or img archives found")
             return {'CANCELLED'}
-        objs = parse_ipl(ipl_path)
-        place_objects(objs, dff_folder)
+        parse_cache = make_parse_cache(props)
+        objs, definitions = collect_instances(context, props, ipl_paths, assets)
+        objs = select_region(objs, assets, region)
+
+        stats = place_objects(objs, assets, parse_cache, props.workers, props.material_scope,
+                              definitions, props.instancing)
         for area in context.window.screen.areas:
             if area.type == 'VIEW_3D':
                 for space in area.spaces:
@@ -131,7 +326,86 @@ class import_autoscan_ipl_operator(bpy.types.Operator):
                         space.shading.color_type = 'TEXTURE'
                         space.shading.show_specular_highlight = False
                         space.shading.show_object_outline = False
-        self.report({'INFO'}, f"imported {len(objs)} objects")
+        msg = f"imported {len(objs)} objects from {len(ipl_paths)} ipl, {stats['models']} unique models, " \
+              f"{stats['materials']} new materials " \
+              f"(cache hits={stats['hits']}, misses={stats['misses']})"
+        if parse_cache:
+            msg += f", parse cache hits={stats['disk_hits']}, misses={stats['disk_misses']}"
+        if stats['out_of_range'] or stats['degenerate'] or stats['duplicate']:
+            msg += f", removed faces: {stats['out_of_range']} out of range, " \
+                   f"{stats['degenerate']} degenerate, {stats['duplicate']} duplicate"
+            msg += " (worst: " + ", ".join(
+                f"{name} {counts['out_of_range']}/{counts['degenerate']}/{counts['duplicate']}"
+                for name, counts in stats['worst']) + ")"
+        if 'pool_error' in stats:
+            msg += f", worker pool unavailable ({stats['pool_error']}), decoded serially"
+        self.report({'WARNING'} if 'pool_error' in stats else {'INFO'}, msg)
+        return {'FINISHED'}
+
+def view_center(context):
+
+    # Pivot of the first 3d view, the point the user navigates around
+    for area in context.window.screen.areas:
+        if area.type == 'VIEW_3D':
+            return tuple(area.spaces.active.region_3d.view_location)
+    return tuple(context.scene.cursor.location)
+
+class stream_autoscan_ipl_operator(bpy.types.Operator):
+    bl_idname = "import.autoscan_ipl_stream"
+    bl_label = "stream ipl"
+    bl_description = "keep the map around the view loaded while navigating, esc to stop"
+
+    def execute(self, context):
+        props = context.scene.autoscan_props
+        if props.streaming:
+            self.report({'ERROR'}, "already streaming")
+            return {'CANCELLED'}
+
+        ipl_paths = selected_ipl_paths(props)
+        if not ipl_paths:
+            self.report({'ERROR'}, "ipl file not found")
+            return {'CANCELLED'}
+        assets = get_index(props.root_path).wait()
+        objs, definitions = collect_instances(context, props, ipl_paths, assets)
+
+        self._loader = StreamLoader(objs, assets, context.collection, props.stream_radius,
+                                    parse_cache=make_parse_cache(props), definitions=definitions,
+                                    material_scope=props.material_scope)
+        self._loader.update(view_center(context))
+        self._timer = context.window_manager.event_timer_add(0.05, window=context.window)
+        context.window_manager.modal_handler_add(self)
+        props.streaming = True
+        self.report({'INFO'}, f"streaming {len(objs)} instances")
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        props = context.scene.autoscan_props
+        if event.type == 'ESC' or not props.streaming:
+            return self.stop(context)
+
+        if event.type == 'TIMER':
+            center = view_center(context)
+            last = self._loader.center
+            step = self._loader.grid.cell_size / 2
+            if last is None or sum((a - b) ** 2 for a, b in zip(center, last)) > step * step:
+                self._loader.update(center)
+            self._loader.step(props.stream_budget)
+
+        return {'PASS_THROUGH'}
+
+    def stop(self, context):
+        context.window_manager.event_timer_remove(self._timer)
+        context.scene.autoscan_props.streaming = False
+        loaded = len(self._loader.placed)
+        self.report({'INFO'}, f"stopped streaming, {loaded} objects stay loaded")
+        return {'FINISHED'}
+
+class stop_stream_operator(bpy.types.Operator):
+    bl_idname = "import.autoscan_ipl_stream_stop"
+    bl_label = "stop streaming"
+
+    def execute(self, context):
+        context.scene.autoscan_props.streaming = False
         return {'FINISHED'}
 
 class export_zip_operator(bpy.types.Operator):
@@ -381,9 +655,42 @@ class unware_tools_panel(bpy.types.Panel):
         box.label(text="map import", icon='IMPORT')
         box.prop(props, "root_path")
         if props.ipl_enum:
-            box.prop(props, "ipl_enum", text="ipl")
+            box.prop(props, "ipl_mode", text="import")
+            if props.ipl_mode == 'ONE':
+                box.prop(props, "ipl_enum", text="ipl")
+            elif props.ipl_mode == 'SELECTED':
+                box.template_list("autoscan_ipl_list", "", props, "ipl_items", props, "ipl_index", rows=6)
             box.prop(props, "optimize", text="optimize")
+            box.prop(props, "workers", text="workers")
+            box.prop(props, "material_scope", text="materials")
+            box.prop(props, "instancing", text="instancing")
+            box.prop(props, "region_mode", text="region")
+            if props.region_mode == 'BOX':
+                row = box.row(align=True)
+                row.prop(props, "region_min", text="")
+                row = box.row(align=True)
+                row.prop(props, "region_max", text="")
+            elif props.region_mode == 'CURSOR':
+                box.prop(props, "region_radius", text="radius")
+            box.prop(props, "lod_level", text="level")
+            if props.lod_level == 'FOCUS':
+                box.prop(props, "lod_radius", text="radius")
+            col = box.column(align=True)
+            col.prop(props, "min_draw_distance", text="min draw distance")
+            col.prop(props, "max_draw_distance", text="max draw distance")
+            col.prop(props, "skip_flags", text="skip flags")
+            box.prop(props, "parse_cache", text="parse cache")
+            if props.parse_cache:
+                box.prop(props, "parse_cache_path", text="cache")
+                box.prop(props, "parse_cache_size", text="size (mb)")
             box.operator("import.autoscan_ipl")
+            col = box.column(align=True)
+            col.prop(props, "stream_radius", text="stream radius")
+            col.prop(props, "stream_budget", text="budget (ms)")
+            if props.streaming:
+                box.operator("import.autoscan_ipl_stream_stop")
+            else:
+                box.operator("import.autoscan_ipl_stream")
         else:
             box.label(text="no ipl files found")
 
@@ -414,20 +721,33 @@ class unware_tools_panel(bpy.types.Panel):
 
 classes = [
     autoscan_ipl_item,
+    autoscan_ipl_list,
     autoscan_props,
     import_autoscan_ipl_operator,
+    stream_autoscan_ipl_operator,
+    stop_stream_operator,
     export_zip_operator,
     SNAP_OT_snapshoot,
     CAR_OT_clean_model,
     unware_tools_panel,
 ]
 
+@persistent
+def reset_streaming(_):
+
+    # The flag is saved with the scene but no stream operator survives a reload
+    for scene in bpy.data.scenes:
+        scene.autoscan_props.streaming = False
+
 def register():
     for cls in classes:
         bpy.utils.register_class(cls)
     bpy.types.Scene.autoscan_props = bpy.props.PointerProperty(type=autoscan_props)
+    bpy.app.handlers.load_post.append(reset_streaming)
 
 def unregister():
+    if reset_streaming in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(reset_streaming)
     for cls in reversed(classes):
         bpy.utils.unregister_class(cls)
     del bpy.types.Scene.autoscan_props
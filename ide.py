@@ -0,0 +1,155 @@
+import os
+from collections import namedtuple
+
+# draw_distance is 0 for definitions without one (cars, peds, hier)
+IdeObject = namedtuple("IdeObject", "id model txd draw_distance flags section")
+IdeEntry  = namedtuple("IdeEntry" , "section fields")
+
+IDE_SECTIONS = {
+    'objs', 'tobj', 'anim', 'cars', 'peds', 'weap',
+    'hier', '2dfx', 'txdp', 'path',
+}
+
+def _int(value, default=0):
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return int(value, 16)
+        except ValueError:
+            return default
+
+def _float(value, default=0.0):
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+def iter_sections(lines, sections):
+
+    # Shared by IPL and IDE files, yields (section, fields) of every entry
+    # in one of `sections`. Inline # and // comments are stripped.
+    section = None
+    for raw in lines:
+        line = raw.split('#', 1)[0].split('//', 1)[0].strip()
+        if not line:
+            continue
+
+        key = line.lower()
+        if section is None:
+            if key in sections:
+                section = key
+            continue
+        if key == 'end':
+            section = None
+            continue
+
+        yield section, [x.strip() for x in line.split(',')]
+
+def _parse_object(section, parts):
+
+    # objs and tobj come in several layouts, with or without a mesh count
+    # and up to three draw distances, the flags are always last
+    if section == 'tobj':
+        parts = parts[:-2]
+    numbers = parts[3:]
+
+    if section in ('objs', 'tobj'):
+        distances = numbers[:-1] if len(numbers) <= 2 else numbers[1:-1]
+        draw_distance = max((_float(x) for x in distances), default=0.0)
+        flags = _int(numbers[-1]) if numbers else 0
+    elif section == 'anim':
+        draw_distance = _float(numbers[1]) if len(numbers) > 1 else 0.0
+        flags = _int(numbers[2]) if len(numbers) > 2 else 0
+    elif section == 'weap':
+        draw_distance = _float(numbers[2]) if len(numbers) > 2 else 0.0
+        flags = _int(numbers[3]) if len(numbers) > 3 else 0
+    else:
+        draw_distance = 0.0
+        flags = 0
+
+    return IdeObject(_int(parts[0], -1), parts[1], parts[2], draw_distance, flags, section)
+
+def iter_ide(lines):
+
+    # Object definitions as IdeObject, txdp as (txd, parent) IdeEntry and
+    # everything else as IdeEntry
+    for section, parts in iter_sections(lines, IDE_SECTIONS):
+        if section in ('objs', 'tobj', 'anim', 'cars', 'peds', 'weap', 'hier') and len(parts) >= 3:
+            yield section, _parse_object(section, parts)
+        else:
+            yield section, IdeEntry(section, tuple(parts))
+
+class Definitions:
+
+    # id -> definition table of every IDE under a root, with model name and
+    # TXD parent lookups
+
+    def __init__(self):
+        self.objects = {}
+        self.models = {}
+        self.txd_parents = {}
+        self.entries = []
+
+    def load_lines(self, lines):
+        for section, record in iter_ide(lines):
+            if isinstance(record, IdeObject):
+                self.objects[record.id] = record
+                self.models.setdefault(record.model.lower(), record)
+            elif section == 'txdp' and len(record.fields) >= 2:
+                self.txd_parents[record.fields[0].lower()] = record.fields[1].lower()
+            else:
+                self.entries.append(record)
+
+    def load_file(self, path):
+        with open(path, 'r', encoding='utf-8', errors='replace') as file:
+            self.load_lines(file)
+
+    def get(self, id):
+        return self.objects.get(id)
+
+    def find(self, model):
+        return self.models.get(model.lower())
+
+    def resolve(self, id, model=None):
+
+        # Definition of an instance by id, by model name for ids that
+        # aren't defined
+        definition = self.objects.get(id)
+        if definition is None and model:
+            definition = self.find(model)
+        return definition
+
+    def txd(self, id, model=None):
+        definition = self.resolve(id, model)
+        return definition.txd if definition else None
+
+    def __len__(self):
+        return len(self.objects)
+
+def load_definitions(paths):
+    definitions = Definitions()
+    for path in paths:
+        try:
+            definitions.load_file(path)
+        except OSError:
+            pass
+    return definitions
+
+# Parsed once per root, parsed again when an IDE file changes
+_definitions = {}
+
+def get_definitions(assets):
+    paths = sorted(assets.names('.ide').values())
+    key = []
+    for path in paths:
+        try:
+            key.append((path, os.stat(path).st_mtime_ns))
+        except OSError:
+            pass
+    key = tuple(key)
+
+    cached = _definitions.get(assets.root)
+    if cached is None or cached[0] != key:
+        cached = _definitions[assets.root] = (key, load_definitions(paths))
+    return cached[1]
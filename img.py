@@ -0,0 +1,120 @@
+import os
+import mmap
+from struct import unpack_from
+
+SECTOR_SIZE = 2048
+ENTRY_SIZE = 32
+
+class img:
+
+    # Read only access to IMG archives, VER2 (SA) or a v1 .img/.dir pair
+    # (III, VC). The archive is memory mapped and entries are returned as
+    # views into the mapping, nothing is copied.
+
+    #######################################################
+    def __init__(self):
+        self.path = None
+        self.version = 0
+        self.entries = {}
+        self._file = None
+        self._mmap = None
+        self.data = None
+
+    #######################################################
+    def open(self, path):
+
+        self.close()
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty archive
+            self._mmap = None
+        self.data = memoryview(self._mmap) if self._mmap is not None else memoryview(b'')
+
+        if bytes(self.data[:4]) == b'VER2':
+            self.version = 2
+            count = unpack_from("<I", self.data, 4)[0]
+            self.read_directory(self.data, 8, count)
+        else:
+            self.version = 1
+            with open(self.find_dir(path), 'rb') as file:
+                directory = file.read()
+            self.read_directory(directory, 0, len(directory) // ENTRY_SIZE)
+
+        return self
+
+    #######################################################
+    def find_dir(self, path):
+
+        # v1 keeps its directory in a .dir file next to the archive
+        folder, filename = os.path.split(path)
+        stem = os.path.splitext(filename)[0].lower()
+        for name in os.listdir(folder or '.'):
+            if name.lower() == stem + '.dir':
+                return os.path.join(folder, name)
+        raise ValueError("no directory file for %s" % path)
+
+    #######################################################
+    def read_directory(self, data, pos, count):
+
+        self.entries = {}
+        for i in range(count):
+            offset, size, archive_size, name = unpack_from("<IHH24s", data, pos + i * ENTRY_SIZE)
+
+            # v1 stores a 32 bit size, v2 the streaming and archive size
+            if self.version == 1:
+                size |= archive_size << 16
+            else:
+                size = size or archive_size
+
+            name = bytes(name).split(b'\0', 1)[0].decode('ascii', 'replace').lower()
+            self.entries.setdefault(name, (offset * SECTOR_SIZE, size * SECTOR_SIZE))
+
+    #######################################################
+    def close(self):
+        self.data = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Views handed out are still alive, the mapping is freed
+                # with them
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    #######################################################
+    def __enter__(self):
+        return self
+
+    #######################################################
+    def __exit__(self, *args):
+        self.close()
+
+    #######################################################
+    def __contains__(self, name):
+        return name.lower() in self.entries
+
+    #######################################################
+    def __len__(self):
+        return len(self.entries)
+
+    #######################################################
+    def names(self, ext=None):
+        if ext is None:
+            return list(self.entries)
+        return [name for name in self.entries if name.endswith(ext)]
+
+    #######################################################
+    def read(self, name):
+
+        # View of the entry, or None. Entries are padded to whole sectors.
+        entry = self.entries.get(name.lower())
+        if entry is None:
+            return None
+        offset, size = entry
+        return self.data[offset:offset + size]
@@ -0,0 +1,125 @@
+from array import array
+from math import floor, sqrt
+
+class SpatialGrid:
+
+    # Uniform 2d grid over bounding spheres, cells are keyed by (x, y) and
+    # hold the indices of every sphere that overlaps them. Queries gather
+    # the cells a region touches and then test the spheres exactly.
+
+    def __init__(self, cell_size=100.0):
+        self.cell_size = cell_size
+        self.centers = array('f')
+        self.radii = array('f')
+        self.cells = {}
+        self.z_ranges = {}
+
+    def cell_range(self, min_x, min_y, max_x, max_y):
+        size = self.cell_size
+        return (range(floor(min_x / size), floor(max_x / size) + 1),
+                range(floor(min_y / size), floor(max_y / size) + 1))
+
+    def build(self, centers, radii):
+        self.centers = array('f')
+        self.radii = array('f', radii)
+        self.cells = {}
+        self.z_ranges = {}
+
+        for i, (x, y, z) in enumerate(centers):
+            self.centers.extend((x, y, z))
+            self.insert(i, x, y, z, self.radii[i])
+        return self
+
+    def insert(self, i, x, y, z, r, skip=((), ())):
+
+        # Adds sphere i to the cells it overlaps, except those in the skip
+        # ranges which already hold it
+        xs, ys = self.cell_range(x - r, y - r, x + r, y + r)
+        for cx in xs:
+            for cy in ys:
+                if cx not in skip[0] or cy not in skip[1]:
+                    self.cells.setdefault((cx, cy), []).append(i)
+                low, high = self.z_ranges.get((cx, cy), (z - r, z + r))
+                self.z_ranges[(cx, cy)] = (min(low, z - r), max(high, z + r))
+
+    def grow(self, i, radius):
+
+        # Raises the radius of sphere i once it is known. Radii only grow,
+        # so the sphere never has to leave a cell.
+        x, y, z, r = self.sphere(i)
+        if radius <= r:
+            return
+        self.radii[i] = radius
+        self.insert(i, x, y, z, self.radii[i], self.cell_range(x - r, y - r, x + r, y + r))
+
+    def __len__(self):
+        return len(self.radii)
+
+    def candidates(self, cells):
+        found = set()
+        for cell in cells:
+            found.update(self.cells.get(cell, ()))
+        return sorted(found)
+
+    def sphere(self, i):
+        return self.centers[3 * i], self.centers[3 * i + 1], self.centers[3 * i + 2], self.radii[i]
+
+    def query_box(self, box_min, box_max):
+
+        # Spheres overlapping an axis aligned box
+        (ax, ay, az), (bx, by, bz) = box_min, box_max
+        xs, ys = self.cell_range(ax, ay, bx, by)
+        result = []
+        for i in self.candidates((cx, cy) for cx in xs for cy in ys):
+            x, y, z, r = self.sphere(i)
+            dx = max(ax - x, 0.0, x - bx)
+            dy = max(ay - y, 0.0, y - by)
+            dz = max(az - z, 0.0, z - bz)
+            if dx * dx + dy * dy + dz * dz <= r * r:
+                result.append(i)
+        return result
+
+    def query_sphere(self, center, radius):
+
+        # Spheres overlapping a sphere
+        fx, fy, fz = center
+        xs, ys = self.cell_range(fx - radius, fy - radius, fx + radius, fy + radius)
+        result = []
+        for i in self.candidates((cx, cy) for cx in xs for cy in ys):
+            x, y, z, r = self.sphere(i)
+            if (x - fx) ** 2 + (y - fy) ** 2 + (z - fz) ** 2 <= (r + radius) ** 2:
+                result.append(i)
+        return result
+
+    def query_frustum(self, planes):
+
+        # Spheres inside or crossing a convex volume, planes are
+        # (nx, ny, nz, d) with unit normals pointing inwards. Whole cells
+        # outside any plane are skipped first.
+        size = self.cell_size
+        cells = []
+        for (cx, cy), (low, high) in self.z_ranges.items():
+            box = ((cx * size, (cx + 1) * size), (cy * size, (cy + 1) * size), (low, high))
+            for nx, ny, nz, d in planes:
+                # Corner of the cell furthest along the normal
+                px = box[0][nx >= 0]
+                py = box[1][ny >= 0]
+                pz = box[2][nz >= 0]
+                if nx * px + ny * py + nz * pz + d < 0:
+                    break
+            else:
+                cells.append((cx, cy))
+
+        result = []
+        for i in self.candidates(cells):
+            x, y, z, r = self.sphere(i)
+            if all(nx * x + ny * y + nz * z + d >= -r for nx, ny, nz, d in planes):
+                result.append(i)
+        return result
+
+def offset_radius(radius, center):
+
+    # Conservative radius around the instance origin for a bounding sphere
+    # whose center is offset from it, holds for any rotation
+    x, y, z = center
+    return radius + sqrt(x * x + y * y + z * z)
@@ -0,0 +1,340 @@
+import numpy as np
+from struct import unpack_from
+
+from .dff import Chunk, Sections, TexDict, types
+
+try:
+    from .PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+# Platform ids
+PLATFORM_D3D8 = 8
+PLATFORM_D3D9 = 9
+
+# Raster format
+FORMAT_DEFAULT    = 0x0000
+FORMAT_1555       = 0x0100
+FORMAT_565        = 0x0200
+FORMAT_4444       = 0x0300
+FORMAT_LUM8       = 0x0400
+FORMAT_8888       = 0x0500
+FORMAT_888        = 0x0600
+FORMAT_555        = 0x0A00
+FORMAT_MASK       = 0x0F00
+FORMAT_AUTOMIPMAP = 0x1000
+FORMAT_PAL8       = 0x2000
+FORMAT_PAL4       = 0x4000
+FORMAT_MIPMAP     = 0x8000
+
+# D3D9 surface formats
+D3DFMT_A8R8G8B8 = 21
+D3DFMT_X8R8G8B8 = 22
+D3DFMT_R5G6B5   = 23
+D3DFMT_A1R5G5B5 = 25
+D3DFMT_A4R4G4B4 = 26
+D3DFMT_L8       = 50
+
+def fourcc(code):
+    return unpack_from("<I", code.encode('ascii'))[0]
+
+# DXT variant by D3D9 fourcc, premultiplied DXT2/4 are read like DXT3/5
+DXT_FOURCC = {
+    fourcc('DXT1'): 1,
+    fourcc('DXT2'): 3,
+    fourcc('DXT3'): 3,
+    fourcc('DXT4'): 5,
+    fourcc('DXT5'): 5,
+}
+
+D3D9_FORMATS = {
+    D3DFMT_A8R8G8B8: FORMAT_8888,
+    D3DFMT_X8R8G8B8: FORMAT_888,
+    D3DFMT_R5G6B5:   FORMAT_565,
+    D3DFMT_A1R5G5B5: FORMAT_1555,
+    D3DFMT_A4R4G4B4: FORMAT_4444,
+    D3DFMT_L8:       FORMAT_LUM8,
+}
+
+NATIVE_HEADER = "<I2BH32s32sII2H4B"
+
+#######################################################
+def _expand(values, bits):
+    return ((values.astype(np.uint32) * 255 + (1 << bits - 1) - 1) // ((1 << bits) - 1)).astype(np.uint8)
+
+#######################################################
+def _unpack_16bit(data, width, height, format):
+
+    c = np.frombuffer(data, dtype='<u2', count=width * height).reshape(height, width)
+    rgba = np.empty((height, width, 4), dtype=np.uint8)
+
+    if format == FORMAT_565:
+        rgba[..., 0] = _expand(c >> 11 & 31, 5)
+        rgba[..., 1] = _expand(c >> 5 & 63, 6)
+        rgba[..., 2] = _expand(c & 31, 5)
+        rgba[..., 3] = 255
+    elif format == FORMAT_4444:
+        rgba[..., 0] = _expand(c >> 8 & 15, 4)
+        rgba[..., 1] = _expand(c >> 4 & 15, 4)
+        rgba[..., 2] = _expand(c & 15, 4)
+        rgba[..., 3] = _expand(c >> 12 & 15, 4)
+    else:
+        rgba[..., 0] = _expand(c >> 10 & 31, 5)
+        rgba[..., 1] = _expand(c >> 5 & 31, 5)
+        rgba[..., 2] = _expand(c & 31, 5)
+        rgba[..., 3] = 255 if format == FORMAT_555 else (c >> 15) * 255
+
+    return rgba
+
+#######################################################
+def _color_blocks(blocks, dxt1):
+
+    # blocks is (n, 8), two 565 end points and 16 2-bit indices per block
+    c0 = blocks[:, 0].astype(np.uint16) | blocks[:, 1].astype(np.uint16) << 8
+    c1 = blocks[:, 2].astype(np.uint16) | blocks[:, 3].astype(np.uint16) << 8
+    rgb0 = _unpack_16bit(c0.tobytes(), len(c0), 1, FORMAT_565)[0, :, :3].astype(np.uint16)
+    rgb1 = _unpack_16bit(c1.tobytes(), len(c1), 1, FORMAT_565)[0, :, :3].astype(np.uint16)
+
+    four = (c0 > c1)[:, None] if dxt1 else np.ones((len(blocks), 1), dtype=bool)
+    palette = np.empty((len(blocks), 4, 4), dtype=np.uint8)
+    palette[:, 0, :3] = rgb0
+    palette[:, 1, :3] = rgb1
+    palette[:, 2, :3] = np.where(four, (2 * rgb0 + rgb1) // 3, (rgb0 + rgb1) // 2)
+    palette[:, 3, :3] = np.where(four, (rgb0 + 2 * rgb1) // 3, 0)
+    palette[:, :, 3] = 255
+    palette[:, 3, 3] = np.where(four[:, 0], 255, 0)
+
+    bits = blocks[:, 4:8].copy().view('<u4')
+    indices = bits >> np.arange(0, 32, 2, dtype=np.uint32) & 3
+    return palette[np.arange(len(blocks))[:, None], indices]
+
+#######################################################
+def _alpha_blocks(blocks):
+
+    # DXT5 alpha, two end points and 16 3-bit indices per block
+    a0 = blocks[:, 0].astype(np.uint16)[:, None]
+    a1 = blocks[:, 1].astype(np.uint16)[:, None]
+    steps = np.arange(1, 7, dtype=np.uint16)
+
+    eight = a0 > a1
+    palette = np.zeros((len(blocks), 8), dtype=np.uint16)
+    palette[:, 0:1] = a0
+    palette[:, 1:2] = a1
+    palette[:, 2:8] = np.where(eight, ((7 - steps) * a0 + steps * a1) // 7, 0)
+    palette[:, 2:6] = np.where(eight, palette[:, 2:6], ((5 - steps[:4]) * a0 + steps[:4] * a1) // 5)
+    palette[:, 7] = np.where(eight[:, 0], palette[:, 7], 255)
+
+    bits = np.zeros((len(blocks), 1), dtype=np.uint64)
+    for i in range(6):
+        bits[:, 0] |= blocks[:, 2 + i].astype(np.uint64) << np.uint64(8 * i)
+    indices = (bits >> np.arange(0, 48, 3, dtype=np.uint64) & np.uint64(7)).astype(np.intp)
+    return palette[np.arange(len(blocks))[:, None], indices].astype(np.uint8)
+
+#######################################################
+def _decode_dxt(data, width, height, dxt):
+
+    if PILImage is not None:
+        try:
+            image = PILImage.frombytes('RGBA', (width, height), bytes(data), 'bcn', {1: 1, 3: 2, 5: 3}[dxt])
+            return np.asarray(image, dtype=np.uint8).reshape(height, width, 4)
+        except Exception:
+            pass
+
+    bw, bh = max(1, (width + 3) // 4), max(1, (height + 3) // 4)
+    block_size = 8 if dxt == 1 else 16
+    blocks = np.frombuffer(data, dtype=np.uint8, count=bw * bh * block_size).reshape(-1, block_size)
+
+    if dxt == 1:
+        pixels = _color_blocks(blocks, True)
+    else:
+        pixels = _color_blocks(blocks[:, 8:], False)
+        if dxt == 3:
+            alpha = blocks[:, :8].copy().view('<u8')
+            pixels[:, :, 3] = (alpha >> np.arange(0, 64, 4, dtype=np.uint64) & np.uint64(15)) * 17
+        else:
+            pixels[:, :, 3] = _alpha_blocks(blocks[:, :8])
+
+    # (blocks, 16 texels) -> rows
+    pixels = pixels.reshape(bh, bw, 4, 4, 4).transpose(0, 2, 1, 3, 4).reshape(bh * 4, bw * 4, 4)
+    return np.ascontiguousarray(pixels[:height, :width])
+
+#######################################################
+class TextureNative:
+
+    __slots__ = [
+        'platform',
+        'filters',
+        'uv_addressing',
+        'name',
+        'mask',
+        'raster_format',
+        'd3d_format',
+        'width',
+        'height',
+        'depth',
+        'num_levels',
+        'raster_type',
+        'dxt',
+        'has_alpha',
+        'palette',
+        'levels'
+    ]
+
+    #######################################################
+    def __init__(self):
+
+        self.platform      = 0
+        self.filters       = 0
+        self.uv_addressing = 0
+        self.name          = ""
+        self.mask          = ""
+        self.raster_format = 0
+        self.d3d_format    = 0
+        self.width         = 0
+        self.height        = 0
+        self.depth         = 0
+        self.num_levels    = 0
+        self.raster_type   = 0
+        self.dxt           = 0
+        self.has_alpha     = False
+        self.palette       = None
+        self.levels        = []
+
+    #######################################################
+    def from_mem(data):
+
+        # data is the struct of a D3D8/D3D9 Texture Native, every level is
+        # kept as a view until it is decoded
+        self = TextureNative()
+
+        (self.platform, self.filters, self.uv_addressing, _, name, mask,
+         self.raster_format, self.d3d_format, self.width, self.height,
+         self.depth, self.num_levels, self.raster_type, flags) = unpack_from(NATIVE_HEADER, data)
+
+        if self.platform not in (PLATFORM_D3D8, PLATFORM_D3D9):
+            raise NotImplementedError("unsupported texture platform %d" % self.platform)
+
+        self.name = bytes(name).split(b'\0', 1)[0].decode('ascii', 'replace')
+        self.mask = bytes(mask).split(b'\0', 1)[0].decode('ascii', 'replace')
+
+        # D3D8 stores an alpha flag and the DXT number, D3D9 the surface format
+        if self.platform == PLATFORM_D3D8:
+            self.has_alpha = bool(self.d3d_format)
+            self.dxt = flags
+        else:
+            self.has_alpha = bool(flags & 1)
+            self.dxt = DXT_FOURCC.get(self.d3d_format, 0) if flags & 8 else 0
+
+        pos = 88
+        if self.raster_format & (FORMAT_PAL8 | FORMAT_PAL4):
+            count = 256 if self.raster_format & FORMAT_PAL8 else 32
+            self.palette = np.frombuffer(data, dtype=np.uint8, count=count * 4, offset=pos).reshape(count, 4)
+            pos += count * 4
+
+        self.levels = []
+        for _ in range(self.num_levels):
+            size = unpack_from("<I", data, pos)[0]
+            self.levels.append(data[pos + 4:pos + 4 + size])
+            pos += 4 + size
+
+        return self
+
+    #######################################################
+    def level_size(self, level=0):
+        return max(1, self.width >> level), max(1, self.height >> level)
+
+    #######################################################
+    def to_rgba(self, level=0):
+
+        # Decoded level as (height, width, 4) uint8, top row first
+        width, height = self.level_size(level)
+        data = self.levels[level]
+        format = self.raster_format & FORMAT_MASK
+
+        if self.dxt:
+            return _decode_dxt(data, width, height, self.dxt)
+
+        if self.palette is not None:
+            indices = np.frombuffer(data, dtype=np.uint8)
+            if self.raster_format & FORMAT_PAL4 and len(indices) < width * height:
+                indices = np.stack((indices & 15, indices >> 4), -1).ravel()
+            return self.palette[indices[:width * height]].reshape(height, width, 4)
+
+        if self.platform == PLATFORM_D3D9 and self.d3d_format in D3D9_FORMATS:
+            format = D3D9_FORMATS[self.d3d_format]
+
+        if format in (FORMAT_8888, FORMAT_888):
+            bgra = np.frombuffer(data, dtype=np.uint8, count=width * height * 4).reshape(height, width, 4)
+            rgba = bgra[..., [2, 1, 0, 3]]
+            if format == FORMAT_888:
+                rgba[..., 3] = 255
+            return rgba
+
+        if format == FORMAT_LUM8:
+            lum = np.frombuffer(data, dtype=np.uint8, count=width * height).reshape(height, width)
+            rgba = np.empty((height, width, 4), dtype=np.uint8)
+            rgba[..., :3] = lum[..., None]
+            rgba[..., 3] = 255
+            return rgba
+
+        if format in (FORMAT_1555, FORMAT_565, FORMAT_4444, FORMAT_555):
+            return _unpack_16bit(data, width, height, format)
+
+        raise NotImplementedError("unsupported raster format 0x%x" % self.raster_format)
+
+#######################################################
+class txd:
+
+    #######################################################
+    def __init__(self):
+        self.textures = []
+        self.device_id = 0
+        self.data = b''
+        self.pos = 0
+
+    #######################################################
+    def read_chunk(self):
+        chunk = Sections.read(Chunk, self.data, self.pos)
+        self.pos += 12
+        return chunk
+
+    #######################################################
+    def load_memory(self, data):
+
+        self.data = memoryview(data)
+        self.pos = 0
+        self.textures = []
+
+        chunk = self.read_chunk()
+        if chunk.type != types["Texture Dictionary"]:
+            raise ValueError("not a texture dictionary")
+        end = self.pos + chunk.size
+
+        chunk = self.read_chunk()
+        header = Sections.read(TexDict, self.data, self.pos)
+        self.device_id = header.device_id
+        self.pos += chunk.size
+
+        while self.pos < end and len(self.textures) < header.texture_count:
+            chunk = self.read_chunk()
+            chunk_end = self.pos + chunk.size
+
+            if chunk.type == types["Texture Native"]:
+                struct = self.read_chunk()
+                try:
+                    texture = TextureNative.from_mem(self.data[self.pos:self.pos + struct.size])
+                    self.textures.append(texture)
+                except NotImplementedError:
+                    pass
+
+            self.pos = chunk_end
+
+    #######################################################
+    def load_file(self, filename):
+        with open(filename, mode='rb') as file:
+            self.load_memory(file.read())
+
+    #######################################################
+    def find(self, name):
+        name = name.lower()
+        return next((t for t in self.textures if t.name.lower() == name), None)